@@ -7,6 +7,14 @@ import matplotlib.pyplot as plt
 from mistralai import Mistral
 import datetime
 import os
+import io
+import sys
+import time
+import json
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # --- CONFIGURATION ---
 TICKER = "AAPL"  # Marche avec BTC-USD, LMT, etc.
@@ -23,7 +31,6 @@ def fetch_stock_data(ticker):
 
 # --- STEP 2: TECHNICAL ANALYSIS ---
 def calculate_technicals(df):
-    print("📈 Calcul des indicateurs techniques...")
     df['SMA_50'] = df['Close'].rolling(window=50).mean()
     df['SMA_200'] = df['Close'].rolling(window=200).mean()
     
@@ -34,8 +41,8 @@ def calculate_technicals(df):
     df['RSI'] = 100 - (100 / (1 + rs))
     return df
 
-def generate_chart(df, ticker):
-    print("🎨 Génération du graphique haute résolution...")
+def generate_chart(df, ticker, dpi=300):
+    # Rendu en mémoire (PNG en bytes) : plusieurs rapports en parallèle ne se marchent plus dessus via chart.png
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8), gridspec_kw={'height_ratios': [3, 1]})
     
     # Plot Prix
@@ -54,14 +61,15 @@ def generate_chart(df, ticker):
     ax2.grid(True, alpha=0.3)
     ax2.legend()
 
-    plt.tight_layout()
-    plt.savefig("chart.png", dpi=300)
-    plt.close()
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, dpi=dpi, format="png")
+    plt.close(fig)
+    return buf.getvalue()
 
 # --- STEP 3: NEWS ---
-def get_news(ticker):
-    print(f"📰 Scan des dernières actualités...")
-    stock = yf.Ticker(ticker)
+def get_news(ticker, stock=None):
+    stock = stock or yf.Ticker(ticker)
     news = stock.news[:5]
     headlines = []
     for item in news:
@@ -69,9 +77,7 @@ def get_news(ticker):
     return "\n".join(headlines) if headlines else "Aucune actualité récente trouvée."
 
 # --- STEP 4: MISTRAL AI ---
-def analyze_with_mistral(ticker, df, news_summary, info):
-    print("🧠 Analyse stratégique par Mistral AI...")
-    
+def build_prompt(ticker, df, news_summary, info):
     last = df.iloc[-1]
     quote_type = info.get('quoteType', 'EQUITY')
     
@@ -93,11 +99,14 @@ def analyze_with_mistral(ticker, df, news_summary, info):
     3. Risk Factors
     4. Trading Verdict (Cash-only, no leverage) with Entry, Target, and Stop-Loss.
     """
-    
+    return prompt
+
+def analyze_with_mistral(ticker, df, news_summary, info):
+    print("🧠 Analyse stratégique par Mistral AI...")
     try:
         chat_response = client.chat.complete(
             model="mistral-tiny",
-            messages=[{"role": "user", "content": prompt}]
+            messages=[{"role": "user", "content": build_prompt(ticker, df, news_summary, info)}]
         )
         return chat_response.choices[0].message.content
     except Exception as e:
@@ -111,9 +120,7 @@ class PDF(FPDF):
         self.cell(0, 10, 'QUANT COUNCIL - INSTITUTIONAL REPORT', 0, 1, 'C')
         self.ln(5)
 
-def create_pdf(ticker, analysis_text):
-    print("📄 Construction du rapport PDF...")
-    pdf = PDF()
+def add_report(pdf, ticker, analysis_text, chart_png=None):
     pdf.add_page()
     
     # Titre
@@ -129,8 +136,8 @@ def create_pdf(ticker, analysis_text):
     pdf.ln(5)
 
     # Graphique
-    if os.path.exists("chart.png"):
-        pdf.image("chart.png", x=10, w=190)
+    if chart_png:
+        pdf.image(io.BytesIO(chart_png), x=10, w=190)
     
     # Analyse
     pdf.ln(5)
@@ -146,21 +153,118 @@ def create_pdf(ticker, analysis_text):
     clean_text = clean_text.encode('latin-1', 'replace').decode('latin-1')
     
     pdf.multi_cell(0, 7, clean_text)
-    
-    filename = f"Report_{ticker}_{datetime.datetime.now().strftime('%Y%m%d')}.pdf"
+
+def create_pdf(ticker, analysis_text, chart_png=None, out_dir="."):
+    pdf = PDF()
+    add_report(pdf, ticker, analysis_text, chart_png)
+    filename = os.path.join(out_dir, f"Report_{ticker}_{datetime.datetime.now().strftime('%Y%m%d')}.pdf")
+    pdf.output(filename)
+    return filename
+
+def create_combined_pdf(reports, out_dir="."):
+    # reports : [(ticker, analyse, png)] -> un seul PDF, une section par actif
+    pdf = PDF()
+    for ticker, analysis_text, chart_png in reports: add_report(pdf, ticker, analysis_text, chart_png)
+    filename = os.path.join(out_dir, f"Report_Watchlist_{datetime.datetime.now().strftime('%Y%m%d')}.pdf")
     pdf.output(filename)
     return filename
 
+# --- BATCH MODE (watchlist complète) ---
+def _fetch_details(ticker):
+    # Un seul yf.Ticker par actif pour info + news ; un actif en échec ne bloque pas le lot
+    stock = yf.Ticker(ticker)
+    try: info = stock.info
+    except Exception: info = {}
+    try: news = get_news(ticker, stock)
+    except Exception: news = "Aucune actualité récente trouvée."
+    return info, news
+
+def fetch_batch(tickers, workers=8):
+    print(f"📥 Récupération groupée des données pour {len(tickers)} actifs...")
+    raw = yf.download(tickers, period="1y", group_by="ticker", auto_adjust=True, threads=True, progress=False)
+    frames = {}
+    for t in tickers:
+        try: df = raw[t] if isinstance(raw.columns, pd.MultiIndex) else raw
+        except KeyError: continue
+        df = df.dropna(subset=["Close"])
+        if len(df) >= 30: frames[t] = calculate_technicals(df.copy())
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        details = dict(zip(frames, pool.map(_fetch_details, list(frames))))
+    return {t: (frames[t], *details[t]) for t in frames}
+
+class RateLimiter:
+    # Au plus `concurrency` appels en vol et au plus `per_second` démarrages par seconde
+    def __init__(self, per_second, concurrency):
+        self.interval = 1 / per_second if per_second > 0 else 0
+        self.sem = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.next_slot = 0.0
+
+    async def __aenter__(self):
+        await self.sem.acquire()
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0: await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+async def analyze_with_mistral_async(ticker, df, news_summary, info, limiter, retries=3):
+    prompt = build_prompt(ticker, df, news_summary, info)
+    for attempt in range(retries):
+        try:
+            async with limiter:
+                chat_response = await client.chat.complete_async(model="mistral-tiny", messages=[{"role": "user", "content": prompt}])
+            return chat_response.choices[0].message.content
+        except Exception as e:
+            if attempt == retries - 1: return f"Erreur API: {e}"
+            await asyncio.sleep(2 ** attempt)
+
+async def run_batch(tickers, out_dir=".", combined=False, workers=None, rps=1.0, concurrency=4, dpi=300):
+    t0 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    data = await asyncio.to_thread(fetch_batch, tickers)
+    if not data:
+        print("❌ Aucune donnée exploitable.")
+        return []
+    loop = asyncio.get_running_loop()
+    limiter = RateLimiter(rps, concurrency)
+    workers = min(workers or os.cpu_count(), len(data))
+    # spawn et non fork : le processus a déjà un ThreadPoolExecutor et une boucle asyncio (verrous hérités -> deadlock)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Graphiques (CPU) dans le pool de processus pendant que les appels Mistral (réseau) tournent en parallèle
+        print(f"🎨 {len(data)} graphiques sur {workers} processus, 🧠 analyses Mistral ({rps:g} req/s max)...")
+        charts = {t: loop.run_in_executor(pool, generate_chart, df, t, dpi) for t, (df, _, _) in data.items()}
+        analyses = await asyncio.gather(*(analyze_with_mistral_async(t, df, news, info, limiter) for t, (df, info, news) in data.items()))
+        reports = [(t, analysis, await charts[t]) for t, analysis in zip(data, analyses)]
+        print("📄 Construction des rapports PDF...")
+        if combined: files = [await loop.run_in_executor(pool, create_combined_pdf, reports, out_dir)]
+        else: files = await asyncio.gather(*(loop.run_in_executor(pool, create_pdf, t, a, png, out_dir) for t, a, png in reports))
+    print(f"✅ {len(files)} PDF pour {len(reports)} actifs en {time.perf_counter() - t0:.1f}s")
+    return files
+
+def load_tickers(path):
+    # watchlist.json (liste JSON) ou un symbole par ligne
+    with open(path) as f: text = f.read()
+    try: return [t.upper() for t in json.loads(text)]
+    except ValueError: return [l.strip().upper() for l in text.splitlines() if l.strip() and not l.startswith("#")]
+
 # --- MAIN ---
 def main():
     df, info = fetch_stock_data(TICKER)
+    print("📈 Calcul des indicateurs techniques...")
     df = calculate_technicals(df)
-    generate_chart(df, TICKER)
+    print("🎨 Génération du graphique haute résolution...")
+    chart = generate_chart(df, TICKER)
+    print(f"📰 Scan des dernières actualités...")
     news = get_news(TICKER)
     
     analysis = analyze_with_mistral(TICKER, df, news, info)
     
-    filename = create_pdf(TICKER, analysis)
+    print("📄 Construction du rapport PDF...")
+    filename = create_pdf(TICKER, analysis, chart)
     print(f"\n✅ Terminé ! Rapport disponible : {filename}")
     
     # Ouvre le dossier automatiquement (Windows)
@@ -168,4 +272,20 @@ def main():
         os.startfile('.')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Rapports PDF Quant Council (un actif, ou une watchlist en mode batch)")
+    parser.add_argument("tickers", nargs="*", help=f"symboles ; aucun -> rapport unique sur {TICKER}")
+    parser.add_argument("--watchlist", help="fichier watchlist.json ou un symbole par ligne")
+    parser.add_argument("--combined", action="store_true", help="un seul PDF pour tout le lot")
+    parser.add_argument("--out", default=".", help="dossier de sortie")
+    parser.add_argument("--workers", type=int, default=None, help="processus de rendu (défaut : nombre de coeurs)")
+    parser.add_argument("--rps", type=float, default=1.0, help="appels Mistral max par seconde")
+    parser.add_argument("--concurrency", type=int, default=4, help="appels Mistral simultanés max")
+    parser.add_argument("--dpi", type=int, default=300)
+    args = parser.parse_args()
+
+    tickers = [t.upper() for t in args.tickers] + (load_tickers(args.watchlist) if args.watchlist else [])
+    if not tickers: main()
+    else:
+        files = asyncio.run(run_batch(list(dict.fromkeys(tickers)), args.out, args.combined, args.workers, args.rps, args.concurrency, args.dpi))
+        for f in files: print(f)
+        sys.exit(0 if files else 1)
\ No newline at end of file
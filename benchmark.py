@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# Le bot écrit son stock OHLCV dans DATA_DIR : chaque bench part d'un dossier vierge
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench_data_"))
+import discord_hedge_bot as hb
+
+# --- FOURNISSEUR SYNTHÉTIQUE (déterministe, hors-ligne) ---
+class SyntheticProvider(hb.MarketDataProvider):
+    # Marche aléatoire reproductible par symbole (graine = crc32 du ticker), latence injectable
+    def __init__(self, days=400, latency=0.0, jitter=0.0, seed=0):
+        self.days, self.latency, self.jitter = days, latency, jitter
+        self.rng = np.random.default_rng(seed)
+        self.end = pd.Timestamp(datetime.date.today())
+
+    def _wait(self):
+        delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0: time.sleep(delay)
+
+    def _frame(self, symbol):
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        idx = pd.bdate_range(end=self.end, periods=self.days, name="Date")
+        close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, self.days)))
+        spread = np.abs(rng.normal(0, 0.01, self.days))
+        vol = rng.lognormal(14, 0.5, self.days)
+        return pd.DataFrame({"Open": close * (1 - spread / 2), "High": close * (1 + spread), "Low": close * (1 - spread),
+                             "Close": close, "Volume": vol}, index=idx)
+
+    def _slice(self, symbol, period, start):
+        df = self._frame(symbol)
+        begin = pd.Timestamp(start) if start else self.end - pd.Timedelta(days=hb.PERIOD_DAYS.get(period or "1mo", 1))
+        return df[df.index >= begin]
+
+    def history(self, symbol, period=None, interval="1d", start=None):
+        self._wait()
+        return self._slice(symbol, period, start)
+
+    def download(self, symbols, period=None, interval="1d", start=None):
+        self._wait()
+        return {s: self._slice(s, period, start) for s in symbols}
+
+    def info(self, symbol):
+        self._wait()
+        return {"quoteType": "EQUITY", "sector": "Technology", "trailingPE": 25.0, "trailingEps": 5.0, "bookValue": 20.0,
+                "heldPercentInstitutions": 0.6, "longBusinessSummary": f"{symbol} is a synthetic company used for benchmarking. " * 5}
+
+    def options(self, symbol):
+        self._wait()
+        return tuple(str((self.end + pd.Timedelta(days=7 * i)).date()) for i in range(1, 5))
+
+    def option_chain(self, symbol, date):
+        self._wait()
+        rng = np.random.default_rng(zlib.crc32((symbol + date).encode()))
+        strikes = np.arange(20, 120, 2.5)
+        side = lambda: pd.DataFrame({"strike": strikes, "volume": rng.integers(0, 5000, len(strikes)), "openInterest": rng.integers(0, 20000, len(strikes))})
+        return hb.OptionChain(side(), side())
+
+    def calendar(self, symbol):
+        self._wait()
+        return {"Earnings Date": [(self.end + pd.Timedelta(days=zlib.crc32(symbol.encode()) % 60)).date()]}
+
+    def insider(self, symbol):
+        self._wait()
+        return pd.DataFrame({"Text": ["Purchase at price 10", "Sale at price 12", "Sale at price 11"]})
+
+class CannedLLM(hb.LLMProvider):
+    def __init__(self, latency=0.0): self.latency = latency
+
+    async def generate(self, prompt):
+        await asyncio.sleep(self.latency)
+        text = ("[SENTIMENT]: 62\n[POLITICAL]: 3\n[SUMMARY]: Synthetic asset in a steady uptrend. Volume is normal.\n"
+                "[THESIS]: Trend intact.\n[DRIVERS]: - Momentum\n- Flows\n[RISKS]: - Macro\n- Valuation\n[VERDICT]: Hold, Target 60, Stop 45.")
+        return text, len(prompt) // 4, len(text) // 4
+
+# --- FAUX DISCORD (latence d'API simulée) ---
+class FakeMessage:
+    def __init__(self, channel, content=""): self.channel, self.content = channel, content
+    async def add_reaction(self, emoji): await asyncio.sleep(self.channel.latency)
+    async def edit(self, **kwargs): await asyncio.sleep(self.channel.latency)
+    async def delete(self): await asyncio.sleep(self.channel.latency)
+
+class FakeChannel:
+    def __init__(self, cid, latency):
+        self.id, self.latency, self.sent = cid, latency, 0
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        return FakeMessage(self)
+
+# --- MESURES ---
+def percentiles(samples):
+    if not samples: return {}
+    a = np.asarray(samples) * 1000
+    return {"n": len(a), "p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)),
+            "p99_ms": float(np.percentile(a, 99)), "max_ms": float(a.max())}
+
+def peak_rss_mb():
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / 1024 if sys.platform != "darwin" else kb / 1e6
+
+def reset_caches():
+    # Chaque scénario démarre à froid : cache mémoire, stock disque, graphiques et mémos vides
+    hb.MARKET_CACHE = hb.MarketDataCache(hb.CACHE_MAX_MB * 1e6)
+    hb.OHLCV_STORE = hb.OHLCVStore(tempfile.mkdtemp(prefix="bench_ohlcv_"))
+    hb.CHART_CACHE.clear()
+    hb.LLM.cache.clear()
+    hb.ANALYSIS.recent.clear()
+    hb.SMART_MONEY.values.clear()
+
+def symbols(n, prefix="S"):
+    # Synthétique : symboles inventés ; fixtures : les symboles enregistrés (n plafonné)
+    if ARGS.fixtures: return sorted(d for d in os.listdir(ARGS.fixtures) if os.path.isdir(os.path.join(ARGS.fixtures, d)))[:n]
+    return [f"{prefix}{i:05d}" for i in range(n)]
+
+def bench_terminal_stages(n):
+    print(f"⏱️  Terminal : {n} symboles, étape par étape...")
+    reset_caches()
+    stages = {k: [] for k in ("fetch", "metrics", "smart_money", "chart", "llm", "discord")}
+    channel = FakeChannel(1, ARGS.discord_ms / 1000)
+    for t in symbols(n, "T"):
+        t0 = time.perf_counter()
+        stock = hb.CachedTicker(t)
+        df = stock.history(period="1y")
+        t1 = time.perf_counter()
+        ind = hb.compute_indicators(*hb.frames_to_matrix([df]))
+        metrics = hb.calculate_metrics(stock, df, ind)
+        t2 = time.perf_counter()
+        hb.get_smart_money_data(stock, metrics["QuoteType"])
+        t3 = time.perf_counter()
+        png = hb.chart_png(df, t, ind)
+        t4 = time.perf_counter()
+        asyncio.run(hb.LLM.generate(f"Asset: {t}"))
+        t5 = time.perf_counter()
+        asyncio.run(channel.send(embed=None))
+        t6 = time.perf_counter()
+        for k, a, b in (("fetch", t0, t1), ("metrics", t1, t2), ("smart_money", t2, t3), ("chart", t3, t4), ("llm", t4, t5), ("discord", t5, t6)):
+            stages[k].append(b - a)
+        if png is None: print(f"⚠️ Graphique refusé (file pleine) pour {t}")
+    return {k: percentiles(v) for k, v in stages.items()}
+
+def bench_terminal_end_to_end(n, concurrency):
+    print(f"⏱️  Terminal bout-en-bout : {n} demandes, {concurrency} en parallèle...")
+    reset_caches()
+    channels = [FakeChannel(i, ARGS.discord_ms / 1000) for i in range(max(1, concurrency))]
+    lat = []
+
+    async def one(i, t):
+        ch = channels[i % len(channels)]
+        t0 = time.perf_counter()
+        await hb.run_analysis(FakeMessage(ch, t), t)
+        lat.append(time.perf_counter() - t0)
+
+    async def main():
+        sem = asyncio.Semaphore(concurrency)
+        async def guarded(i, t):
+            async with sem: await one(i, t)
+        await asyncio.gather(*(guarded(i, t) for i, t in enumerate(symbols(n, "E"))))
+
+    t0 = time.perf_counter()
+    asyncio.run(main())
+    wall = time.perf_counter() - t0
+    return dict(percentiles(lat), wall_s=wall, throughput_per_s=n / wall)
+
+def bench_chart(n):
+    print(f"⏱️  Rendu graphique : {n} rendus froids + {n} servis depuis le cache...")
+    reset_caches()
+    df = hb.CachedTicker(symbols(1, "CHART")[0]).history(period="1y")
+    ind = hb.compute_indicators(*hb.frames_to_matrix([df]))
+    t0 = time.perf_counter()
+    hb.chart_png(df, "WARMUP", ind)
+    first = time.perf_counter() - t0
+    cold, warm = [], []
+    for i in range(n):
+        t0 = time.perf_counter(); hb.chart_png(df, f"C{i}", ind); cold.append(time.perf_counter() - t0)
+        t0 = time.perf_counter(); hb.chart_png(df, f"C{i}", ind); warm.append(time.perf_counter() - t0)
+    return {"pool_start_plus_first_ms": first * 1000, "cold": percentiles(cold), "cached": percentiles(warm)}
+
+def bench_scanner(size):
+    print(f"⏱️  Scanner : watchlist de {size} symboles...")
+    reset_caches()
+    watchlist = symbols(size)
+    t0 = time.perf_counter()
+    anomalies = asyncio.run(hb.run_scanner(watchlist))
+    cold = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    asyncio.run(hb.run_scanner(watchlist))
+    warm = time.perf_counter() - t0
+    frames = hb.batch_history(watchlist)
+    t0 = time.perf_counter()
+    close, volume = hb.frames_to_matrix(list(frames.values()))
+    t1 = time.perf_counter()
+    hb.compute_indicators(close, volume)
+    indicators = time.perf_counter() - t1
+    return {"symbols": len(watchlist), "anomalies": sum(1 for a in anomalies if a.reasons), "cold_s": cold, "warm_s": warm,
+            "cold_symbols_per_s": size / cold, "warm_symbols_per_s": size / warm,
+            "indicators_only_ms": indicators * 1000, "matrix_build_ms": (t1 - t0) * 1000, "peak_rss_mb": peak_rss_mb()}
+
+# --- COMPARAISON AVEC UNE RÉFÉRENCE ---
+def probe_startup(mode):
+    # Exécuté dans un processus neuf : 1er terminal sans warm-up ("cold") ou après hb.warmup() ("warm")
+    async def main():
+        if mode == "warm": await hb.warmup()
+        ch = FakeChannel(1, ARGS.discord_ms / 1000)
+        for t in symbols(2, "BOOT"):
+            t0 = time.perf_counter()
+            await hb.run_analysis(FakeMessage(ch, t), t)
+            lat.append(time.perf_counter() - t0)
+    lat = []
+    asyncio.run(main())
+    print(json.dumps({"import_s": hb.TRACER.summary()["startup.import"]["p50"], "warmup_s": hb.BOOT["warmup"] or 0.0,
+                      "first_terminal_s": lat[0], "second_terminal_s": lat[1]}))
+
+def bench_startup():
+    print("⏱️  Démarrage à froid : import du bot + 1er terminal, sans puis avec warm-up...")
+    out = {}
+    for mode in ("cold", "warm"):
+        cmd = [sys.executable, os.path.abspath(__file__), "--probe", mode, "--llm-ms", str(ARGS.llm_ms), "--discord-ms", str(ARGS.discord_ms)]
+        if ARGS.fixtures: cmd += ["--fixtures", ARGS.fixtures]
+        env = dict(os.environ, DATA_DIR=tempfile.mkdtemp(prefix="bench_boot_"))
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+        out[mode] = json.loads(proc.stdout.strip().splitlines()[-1])
+    return out
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict): out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool): out[key] = v
+    return out
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f: base = flatten(json.load(f)["results"])
+    cur = flatten(results)
+    regressions = []
+    for k, v in cur.items():
+        if k not in base or not base[k]: continue
+        # Latences / durées : plus haut = pire ; débits : plus bas = pire
+        if k.endswith(("_ms", "_s")) and v > base[k] * (1 + tolerance): regressions.append((k, base[k], v))
+        if k.endswith("_per_s") and v < base[k] * (1 - tolerance): regressions.append((k, base[k], v))
+    return regressions
+
+# --- MAIN ---
+def main():
+    global ARGS
+    p = argparse.ArgumentParser(description="Benchmark hors-ligne du terminal et du scanner.")
+    p.add_argument("--sizes", default="10,100,1000,5000", help="tailles de watchlist pour le scanner")
+    p.add_argument("--terminals", type=int, default=20, help="nombre de terminaux mesurés étape par étape")
+    p.add_argument("--concurrency", type=int, default=8, help="demandes de terminal simultanées (bout-en-bout)")
+    p.add_argument("--charts", type=int, default=10, help="rendus de graphiques mesurés")
+    p.add_argument("--fixtures", help="rejouer un dossier enregistré (MARKET_DATA_PROVIDER=record:...) au lieu du synthétique")
+    p.add_argument("--latency-ms", type=float, default=0.0, help="latence injectée par appel fournisseur")
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--llm-ms", type=float, default=800.0, help="latence simulée d'un appel LLM")
+    p.add_argument("--discord-ms", type=float, default=80.0, help="latence simulée d'un appel API Discord")
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--baseline", help="résultats précédents à comparer")
+    p.add_argument("--tolerance", type=float, default=0.2, help="régression tolérée (0.2 = 20%%)")
+    p.add_argument("--probe", choices=("cold", "warm"), help=argparse.SUPPRESS)  # interne : sous-processus de bench_startup
+    ARGS = p.parse_args()
+
+    if ARGS.fixtures: hb.PROVIDER = hb.FixtureProvider(ARGS.fixtures, ARGS.latency_ms / 1000, ARGS.jitter_ms / 1000)
+    else: hb.PROVIDER = SyntheticProvider(latency=ARGS.latency_ms / 1000, jitter=ARGS.jitter_ms / 1000)
+    hb.LLM_PROVIDER = CannedLLM(ARGS.llm_ms / 1000)
+    if ARGS.probe: return probe_startup(ARGS.probe)
+
+    started = time.perf_counter()
+    results = {"startup": bench_startup(), "chart": bench_chart(ARGS.charts), "terminal_stages": bench_terminal_stages(ARGS.terminals),
+               "terminal_end_to_end": bench_terminal_end_to_end(ARGS.terminals, ARGS.concurrency), "scanner": {}}
+    for size in [int(x) for x in ARGS.sizes.split(",") if x]: results["scanner"][str(size)] = bench_scanner(size)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    report = {"generated_at": datetime.datetime.now().isoformat(timespec="seconds"), "duration_s": time.perf_counter() - started,
+              "python": platform.python_version(), "cpus": os.cpu_count(), "args": vars(ARGS), "results": results}
+    with open(ARGS.out, "w") as f: json.dump(report, f, indent=2)
+    print(f"\n✅ Résultats : {ARGS.out}")
+    for mode, r in results["startup"].items():
+        print(f"   boot {mode:<5}: import {r['import_s']:.2f}s | warm-up {r['warmup_s']:.1f}s | 1er terminal {r['first_terminal_s']:.2f}s (2e : {r['second_terminal_s']:.2f}s)")
+    for k, v in results["terminal_stages"].items(): print(f"   {k:<12} p50 {v['p50_ms']:8.1f} ms | p95 {v['p95_ms']:8.1f} ms")
+    for size, r in results["scanner"].items(): print(f"   scan {size:>5} : {r['cold_s']:.2f}s à froid, {r['warm_s']:.2f}s à chaud, RSS {r['peak_rss_mb']:.0f} MB")
+
+    if ARGS.baseline:
+        regressions = compare(results, ARGS.baseline, ARGS.tolerance)
+        for k, old, new in regressions: print(f"🔴 Régression {k}: {old:.2f} -> {new:.2f}")
+        if regressions: sys.exit(1)
+        print("🟢 Aucune régression.")
+
+if __name__ == "__main__":
+    main()
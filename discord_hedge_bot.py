@@ -1,16 +1,32 @@
+import time
+BOOT_T0 = time.perf_counter()  # chrono du démarrage à froid : imports -> on_ready -> warm-up -> 1er terminal
 import discord
 from discord.ext import commands, tasks
-import yfinance as yf
-import pandas as pd
-import mplfinance as mpf
+import numpy as np
 import io
 import asyncio
 import json
 import os
 import datetime
-from google import genai
+import zoneinfo
 import re
-from collections import deque
+import sys
+import hashlib
+import threading
+import multiprocessing
+import random
+import glob
+import shutil
+import tempfile
+import bisect
+import sqlite3
+import importlib
+import urllib.request
+import functools
+from contextlib import contextmanager
+from collections import deque, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 
 # --- SÉCURITÉ & CONFIGURATION ---
@@ -18,27 +34,827 @@ load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 ALERT_CHANNEL_ID = int(os.getenv("ALERT_CHANNEL_ID", 0))
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", 8))
+SCAN_TICKER_TIMEOUT = float(os.getenv("SCAN_TICKER_TIMEOUT", 30))
+DATA_DIR = os.getenv("DATA_DIR", "data")
+PROVIDER_LATENCY = float(os.getenv("PROVIDER_LATENCY_MS", 0)) / 1000
+PROVIDER_JITTER = float(os.getenv("PROVIDER_JITTER_MS", 0)) / 1000
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", 2))
+CHART_QUEUE_MAX = int(os.getenv("CHART_QUEUE_MAX", 8))
+CHART_QUEUE_TIMEOUT = float(os.getenv("CHART_QUEUE_TIMEOUT", 10))
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", 64))
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", 256))
+CACHE_TTL = {
+    "history": int(os.getenv("CACHE_TTL_HISTORY", 300)),
+    "info": int(os.getenv("CACHE_TTL_INFO", 6 * 3600)),
+    "options": int(os.getenv("CACHE_TTL_OPTIONS", 900)),
+    "chain": int(os.getenv("CACHE_TTL_OPTIONS", 900)),
+    "calendar": int(os.getenv("CACHE_TTL_CALENDAR", 12 * 3600)),
+    "insider": int(os.getenv("CACHE_TTL_INSIDER", 24 * 3600)),
+}
 
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-# Configuration de la NOUVELLE API Gemini
-gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+# --- TRACING (latences par étape + erreurs par endpoint) ---
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", 1000))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+class Tracer:
+    def __init__(self, window):
+        self.window = window
+        self.samples = {}     # étape -> deque des dernières latences (histogramme glissant)
+        self.totals = {}      # étape -> [appels, erreurs, secondes cumulées] depuis le démarrage
+        self.last_error = {}  # étape -> dernier message d'erreur
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds=None, error=None):
+        with self.lock:
+            if name not in self.totals: self.samples[name], self.totals[name] = deque(maxlen=self.window), [0, 0, 0.0]
+            if seconds is not None:
+                self.totals[name][0] += 1
+                self.totals[name][2] += seconds
+                self.samples[name].append(seconds)
+            if error is not None:
+                self.totals[name][1] += 1
+                self.last_error[name] = f"{type(error).__name__}: {error}"[:200]
+
+    @contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try: yield
+        except Exception as e:
+            self.record(name, time.perf_counter() - t0, e)
+            raise
+        self.record(name, time.perf_counter() - t0)
+
+    def error(self, name, exc): self.record(name, error=exc)  # erreur rattrapée hors span (timeout, file pleine...)
+
+    def summary(self):
+        with self.lock: rows = {n: (list(self.samples[n]), *self.totals[n]) for n in self.totals}
+        out = {}
+        for name, (lat, calls, errors, total) in sorted(rows.items()):
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if lat else (0.0, 0.0, 0.0)
+            out[name] = {"calls": calls, "errors": errors, "error_rate": errors / calls * 100 if calls else 0, "seconds": total,
+                         "p50": float(p50), "p95": float(p95), "p99": float(p99), "last_error": self.last_error.get(name)}
+        return out
+
+    def prometheus(self):
+        # Format texte Prometheus : une famille = sa ligne TYPE puis tous ses échantillons (summary par étape + compteurs)
+        # Quantiles sur la fenêtre glissante, _sum/_count cumulés depuis le démarrage
+        rows = [(f'stage="{name}"', s) for name, s in self.summary().items()]
+        lines = ["# TYPE bot_stage_latency_seconds summary"]
+        for label, s in rows:
+            for q, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                lines.append(f'bot_stage_latency_seconds{{{label},quantile="{q}"}} {s[key]:.6f}')
+            lines.append(f'bot_stage_latency_seconds_sum{{{label}}} {s["seconds"]:.6f}')
+            lines.append(f'bot_stage_latency_seconds_count{{{label}}} {s["calls"]}')
+        for family, key in (("bot_stage_calls_total", "calls"), ("bot_stage_errors_total", "errors")):
+            lines.append(f"# TYPE {family} counter")
+            lines += [f'{family}{{{label}}} {s[key]}' for label, s in rows]
+        return "\n".join(lines) + "\n"
+
+TRACER = Tracer(TRACE_WINDOW)
+
+def traced(name):
+    # Décorateur : chronomètre la fonction (sync ou async) sous l'étape `name`
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run(*args, **kwargs):
+                with TRACER.span(name): return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def run(*args, **kwargs):
+                with TRACER.span(name): return fn(*args, **kwargs)
+        return run
+    return wrap
+
+async def discord_call(name, coro, channel=None):
+    # channel : l'appel attend d'abord son créneau dans le bucket (route, salon) -> pas de 429 qui gèle tout le salon
+    try: await ROUTES.acquire(name, channel)
+    except BaseException:
+        coro.close()
+        raise
+    with TRACER.span(f"discord.{name}"): return await coro
+
+# --- SORTIE DISCORD (buckets de rate limit par route, pagination, envois fusionnés) ---
+# Buckets Discord par salon (appels, secondes) ; discord.py gère les 429 mais chaque 429 bloque la route entière
+DISCORD_ROUTE_LIMITS = {"message": (5, 5.0), "edit": (5, 5.0), "delete": (5, 1.0), "react": (1, 0.25)}
+DISCORD_ROUTE_OF = {"send": "message", "reply": "message"}
+DISCORD_GLOBAL_RATE = int(os.getenv("DISCORD_GLOBAL_RATE", 45))  # requêtes / s tous salons confondus (limite Discord : 50)
+EMBED_DESC_MAX, EMBED_FIELD_MAX, EMBEDS_PER_MESSAGE, MESSAGE_EMBED_MAX = 4096, 1024, 10, 6000
+
+class RouteLimiter:
+    # Fenêtre glissante par (route, salon) + plafond global ; un verrou par route garde l'ordre d'arrivée des envois
+    def __init__(self, limits, global_rate):
+        self.limits, self.global_limit = limits, (global_rate, 1.0)
+        self.windows, self.locks, self.global_window = {}, {}, deque()
+
+    @staticmethod
+    async def _wait(window, calls, period):
+        while len(window) >= calls:
+            delay = window[0] + period - time.monotonic()
+            if delay <= 0: window.popleft()
+            else: await asyncio.sleep(delay)
+
+    async def acquire(self, name, channel=None):
+        route = DISCORD_ROUTE_OF.get(name, name)
+        key = (route, channel.id) if channel is not None and route in self.limits else None
+        t0 = time.monotonic()
+        if key is None: await self._wait(self.global_window, *self.global_limit)
+        else:
+            async with self.locks.setdefault(key, asyncio.Lock()):
+                window = self.windows.setdefault(key, deque())
+                await self._wait(window, *self.limits[route])
+                await self._wait(self.global_window, *self.global_limit)
+                window.append(time.monotonic())
+        self.global_window.append(time.monotonic())
+        if time.monotonic() - t0 > 0.001: TRACER.record("discord.throttled", time.monotonic() - t0)
+
+ROUTES = RouteLimiter(DISCORD_ROUTE_LIMITS, DISCORD_GLOBAL_RATE)
+
+def clip_lines(lines, limit):
+    # Coupe sur une fin de ligne (jamais au milieu d'un symbole) et indique ce qui manque
+    out, size = [], 0
+    for i, line in enumerate(lines):
+        if size + len(line) + 1 > limit - 12:
+            out.append(f"… +{len(lines) - i}")
+            break
+        out.append(line)
+        size += len(line) + 1
+    return "\n".join(out)
+
+def group_embeds(embeds):
+    # Embeds -> messages de ≤ 10 embeds et ≤ 6000 caractères cumulés
+    groups, size = [[]], 0
+    for e in embeds:
+        if groups[-1] and (len(groups[-1]) >= EMBEDS_PER_MESSAGE or size + len(e) > MESSAGE_EMBED_MAX): groups.append([]); size = 0
+        groups[-1].append(e)
+        size += len(e)
+    return groups
+
+def paginate(title, lines, color, footer=None):
+    # Rapport long -> pages de ≤ 4096 caractères (coupées entre deux lignes), numérotées
+    pages, cur = [], ""
+    for line in lines:
+        line = line[:EMBED_DESC_MAX]
+        if cur and len(cur) + 1 + len(line) > EMBED_DESC_MAX: pages.append(cur); cur = line
+        else: cur = f"{cur}\n{line}" if cur else line
+    if cur: pages.append(cur)
+    embeds = [discord.Embed(title=title if len(pages) == 1 else f"{title} ({i + 1}/{len(pages)})", description=text, color=color) for i, text in enumerate(pages)]
+    if embeds and footer: embeds[-1].set_footer(text=footer)
+    return embeds
+
+async def send_embeds(channel, embeds):
+    for group in group_embeds(embeds): await discord_call("send", channel.send(embeds=group), channel)
+
+async def deliver(channel, status, embeds, png=None, filename="chart.png"):
+    # Résultat d'une commande en un seul appel : le message de statut devient le résultat (texte -> graphique + embeds)
+    # au lieu de delete + send(graphique) + send(mémo). Statut disparu entre-temps -> envoi classique.
+    groups = group_embeds(embeds)
+    def chart(): return [discord.File(io.BytesIO(png), filename=filename)] if png else []
+    try:
+        if status is None: raise LookupError
+        await discord_call("edit", status.edit(content=None, embeds=groups[0], attachments=chart()), channel)
+    except (LookupError, discord.NotFound):
+        await discord_call("send", channel.send(embeds=groups[0], files=chart()), channel)
+    for group in groups[1:]: await discord_call("send", channel.send(embeds=group), channel)
+
+# --- IMPORTS DIFFÉRÉS (yfinance, pandas, matplotlib, google-genai : chargés au premier usage ou au warm-up) ---
+class LazyModule:
+    # Proxy de module : l'import réel (et son coût) n'a lieu qu'au premier accès à un attribut
+    def __init__(self, name):
+        self.name, self.module, self.lock = name, None, threading.Lock()
+
+    def load(self):
+        if self.module is None:
+            with self.lock:
+                if self.module is None:
+                    with TRACER.span(f"import.{self.name}"): self.module = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attr): return getattr(self.load(), attr)
+
+pd = LazyModule("pandas")
+yf = LazyModule("yfinance")
+mpf = LazyModule("mplfinance")
+plt = LazyModule("matplotlib.pyplot")
+genai = LazyModule("google.genai")
+BOOT = {"ready": None, "warmup": None, "first_terminal": None}  # secondes depuis BOOT_T0 / durée du warm-up
+
+# --- COUCHE LLM (SDK async natif + cache des mémos + limite de concurrence) ---
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", 4))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 3600))
+
+class LLMProvider:
+    # Interface : generate(prompt) -> (texte, tokens prompt, tokens réponse)
+    async def generate(self, prompt): raise NotImplementedError
+
+class GeminiProvider(LLMProvider):
+    def __init__(self): self._client = None
+
+    @property
+    def client(self):
+        # Construit au premier appel ou pendant le warm-up (pool HTTP), jamais au chargement du module
+        if self._client is None: self._client = genai.Client(api_key=GEMINI_API_KEY)
+        return self._client
+
+    async def generate(self, prompt):
+        response = await self.client.aio.models.generate_content(model=LLM_MODEL, contents=prompt)
+        usage = getattr(response, "usage_metadata", None)
+        return response.text, getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+class FixtureLLMProvider(LLMProvider):
+    # Réponses figées depuis un JSON : {"default": "...", "match": {"sous-chaîne du prompt": "réponse"}}
+    def __init__(self, path, latency=0.0, jitter=0.0, seed=0):
+        with open(path) as f: self.responses = json.load(f)
+        self.latency, self.jitter, self.rng = latency, jitter, random.Random(seed)
+
+    async def generate(self, prompt):
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        text = next((v for k, v in self.responses.get("match", {}).items() if k in prompt), self.responses.get("default", ""))
+        return text, len(prompt) // 4, len(text) // 4
+
+class LLMClient:
+    def __init__(self, max_concurrent, cache_ttl):
+        self.sem = asyncio.Semaphore(max_concurrent)
+        self.cache_ttl, self.cache = cache_ttl, {}  # clé -> (expire_à, texte)
+        self.calls = deque(maxlen=500)              # (latence s, tokens prompt, tokens réponse)
+        self.stats = {"calls": 0, "cache_hits": 0, "errors": 0, "prompt_tokens": 0, "output_tokens": 0}
+
+    async def generate(self, prompt, cache_key=None):
+        if cache_key:
+            hit = self.cache.get(cache_key)
+            if hit and hit[0] > time.monotonic():
+                self.stats["cache_hits"] += 1
+                return hit[1]
+        async with self.sem:
+            t0 = time.perf_counter()
+            try:
+                with TRACER.span("llm.generate"): text, p_tok, o_tok = await LLM_PROVIDER.generate(prompt)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            latency = time.perf_counter() - t0
+        self.calls.append((latency, p_tok, o_tok))
+        self.stats["calls"] += 1
+        self.stats["prompt_tokens"] += p_tok
+        self.stats["output_tokens"] += o_tok
+        if cache_key:
+            now = time.monotonic()
+            for k in [k for k, (exp, _) in self.cache.items() if exp <= now]: del self.cache[k]
+            self.cache[cache_key] = (now + self.cache_ttl, text)
+        return text
+
+    def summary(self):
+        lat = sorted(c[0] for c in self.calls)
+        s = dict(self.stats)
+        s["p50"] = lat[len(lat) // 2] if lat else 0
+        s["p95"] = lat[min(len(lat) - 1, int(len(lat) * 0.95))] if lat else 0
+        return s
+
+def make_llm_provider(spec):
+    # "gemini" (défaut) | "fixture:<fichier.json>"
+    kind, _, arg = spec.partition(":")
+    if kind == "fixture": return FixtureLLMProvider(arg, PROVIDER_LATENCY, PROVIDER_JITTER)
+    return GeminiProvider()
+
+LLM_PROVIDER = make_llm_provider(os.getenv("LLM_PROVIDER", "gemini"))
+LLM = LLMClient(LLM_MAX_CONCURRENT, LLM_CACHE_TTL)
+
+MACRO_VIX = re.compile(r'VIX: ([\d.]+)')
+
+def macro_bucket(macro):
+    # "SPY: BULLISH 🟢 | VIX: 17.43" -> ("BULLISH", 3) : tendance SPY + tranche de VIX de 5 points, stable sur la séance
+    vix = MACRO_VIX.search(macro)
+    return ["BULLISH" in macro, int(float(vix.group(1)) // 5) if vix else None]
+
+def options_bucket(flow):
+    # P/C à 1 décimale + présence de flux inhabituel : le texte formaté du prompt bouge à chaque print
+    r = lambda x: round(x, 1) if np.isfinite(x) else None
+    return [r(flow.pc_volume), r(flow.pc_oi), bool(flow.unusual)]
+
+def memo_cache_key(ticker, metrics, macro, options, insider, earnings):
+    # Entrées arrondies (et non les chaînes du prompt) : deux terminaux du même jour avec des chiffres quasi identiques partagent le mémo
+    inputs = [ticker, f"{metrics['Price']:.3g}", round(metrics['RSI']), round(metrics['MaxDD']), bool(metrics['Squeeze']),
+              options_bucket(options), insider, earnings, macro_bucket(macro), str(market_today())]
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False).encode()).hexdigest()
 
 # --- MÉMOIRE & WATCHLIST ---
-CHAT_HISTORY = {} 
-WATCHLIST_FILE = "watchlist.json"
+MEMORY_DB = os.path.join(DATA_DIR, "memory.db")
+MEMORY_PER_CHANNEL = int(os.getenv("MEMORY_PER_CHANNEL", 50))   # snapshots gardés par salon (les plus anciens sortent)
+MEMORY_MAX_CHANNELS = int(os.getenv("MEMORY_MAX_CHANNELS", 500))  # au-delà, les salons inactifs depuis le plus longtemps sont purgés
+MEMORY_TTL_DAYS = float(os.getenv("MEMORY_TTL_DAYS", 30))
+MEMORY_RECENT = 3  # question sans symbole reconnu -> les derniers snapshots du salon (relances type "et son RSI ?")
+MEMORY_LINE = re.compile(r'^\*\*([^*]+)\*\*')  # lignes d'alerte des scanners : "**TICKER** ($prix) ➔ ..."
+
+class ConversationMemory:
+    # Snapshots persistants (SQLite) clés par (salon, symbole, source) : un terminal récent remplace l'ancien du même symbole.
+    # Le prompt du chat ne reçoit que les snapshots des symboles cités dans la question.
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS channels (channel INTEGER PRIMARY KEY, last_used REAL NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS snapshots (channel INTEGER NOT NULL, ticker TEXT NOT NULL, source TEXT NOT NULL, "
+                        "text TEXT NOT NULL, ts REAL NOT NULL, PRIMARY KEY (channel, ticker, source))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS snapshots_ts ON snapshots (channel, ts)")
+        self.lock = threading.Lock()
+
+    def remember(self, channel, snapshots, source="terminal"):
+        # snapshots : {symbole: texte}
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO channels VALUES (?, ?)", (channel, now))
+            self.db.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)", [(channel, t, source, text, now) for t, text in snapshots.items()])
+            self.db.execute("DELETE FROM snapshots WHERE channel = ? AND rowid NOT IN (SELECT rowid FROM snapshots WHERE channel = ? ORDER BY ts DESC LIMIT ?)",
+                            (channel, channel, MEMORY_PER_CHANNEL))
+            self._evict(now)
+
+    def remember_alerts(self, channel, lines, source):
+        self.remember(channel, {m.group(1): f"[{source.upper()}]: {line}" for line in lines if (m := MEMORY_LINE.match(line))}, source)
+
+    def _evict(self, now):
+        # LRU des salons : inactifs depuis MEMORY_TTL_DAYS, puis les plus anciens au-delà de MEMORY_MAX_CHANNELS
+        stale = [c for (c,) in self.db.execute("SELECT channel FROM channels WHERE last_used < ?", (now - MEMORY_TTL_DAYS * 86400,))]
+        stale += [c for (c,) in self.db.execute("SELECT channel FROM channels WHERE last_used >= ? ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                                                (now - MEMORY_TTL_DAYS * 86400, MEMORY_MAX_CHANNELS))]
+        if not stale: return
+        self.db.executemany("DELETE FROM snapshots WHERE channel = ?", [(c,) for c in stale])
+        self.db.executemany("DELETE FROM channels WHERE channel = ?", [(c,) for c in stale])
+
+    @staticmethod
+    def mentions(question, ticker):
+        # "AAPL" tapé en majuscules, alias connus ("apple"), ou base d'une crypto / d'un titre étranger ("btc" -> BTC-USD).
+        # Les mots en minuscules de moins de 4 lettres sont ignorés : "on", "a", "all" ne doivent pas rappeler ON, A, ALL.
+        keys = {ticker, re.split(r'[-.]', ticker)[0]}
+        for word in re.findall(r'[\^A-Za-z0-9][A-Za-z0-9.\-]*', question):
+            w = word.upper().rstrip(".")
+            if COMMON_TYPOS.get(w, w) in keys and (word.isupper() or len(w) >= 4 or w in COMMON_TYPOS): return True
+        return False
 
-def load_watchlist():
-    if os.path.exists(WATCHLIST_FILE):
-        with open(WATCHLIST_FILE, "r") as f:
-            return json.load(f)
-    return ["AAPL", "MSFT", "NVDA", "TSLA", "BTC-USD", "SPY"]
+    def recall(self, channel, question):
+        with self.lock:
+            rows = self.db.execute("SELECT ticker, text, ts FROM snapshots WHERE channel = ? ORDER BY ts DESC", (channel,)).fetchall()
+            if rows:
+                with self.db: self.db.execute("UPDATE channels SET last_used = ? WHERE channel = ?", (time.time(), channel))
+        picked = [r for r in rows if self.mentions(question, r[0])] or rows[:MEMORY_RECENT]
+        return [f"({datetime.date.fromtimestamp(ts).isoformat()}) {text}" for _, text, ts in reversed(picked)]
+
+MEMORY = ConversationMemory(MEMORY_DB)
+WATCHLIST_FILE = "watchlist.json"  # ancien format, importé une fois dans la liste "default"
+WATCHLIST_DB = os.path.join(DATA_DIR, "watchlist.db")
+DEFAULT_WATCHLIST = ["AAPL", "MSFT", "NVDA", "TSLA", "BTC-USD", "SPY"]
+DEFAULT_SCOPE = "default"
+
+class WatchlistStore:
+    # Un ensemble ordonné en mémoire par serveur (ou DM), write-through SQLite : lu une seule fois au démarrage.
+    # Un serveur sans liste propre voit la liste "default" ; sa première modification l'en copie.
+    def __init__(self, path, legacy_file):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS scopes (scope TEXT PRIMARY KEY)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS watchlist (scope TEXT NOT NULL, ticker TEXT NOT NULL, PRIMARY KEY (scope, ticker))")
+        self.lock = threading.Lock()
+        self.lists = {scope: {} for (scope,) in self.db.execute("SELECT scope FROM scopes")}
+        for scope, ticker in self.db.execute("SELECT scope, ticker FROM watchlist ORDER BY rowid"):
+            self.lists.setdefault(scope, {})[ticker] = None
+        if DEFAULT_SCOPE not in self.lists:
+            legacy = DEFAULT_WATCHLIST
+            if os.path.exists(legacy_file):
+                try:
+                    with open(legacy_file) as f: legacy = json.load(f)
+                except (OSError, ValueError) as e: print(f"Watchlist JSON illisible ({e}), liste par défaut.", flush=True)
+            self._write(DEFAULT_SCOPE, legacy, [])
+
+    def _write(self, scope, added, removed):
+        # Transaction SQLite d'abord, mémoire ensuite : un crash ne laisse jamais les deux divergents
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO scopes VALUES (?)", (scope,))
+            self.db.executemany("INSERT OR IGNORE INTO watchlist VALUES (?, ?)", [(scope, t) for t in added])
+            self.db.executemany("DELETE FROM watchlist WHERE scope = ? AND ticker = ?", [(scope, t) for t in removed])
+        entries = self.lists.setdefault(scope, {})
+        for t in added: entries[t] = None
+        for t in removed: entries.pop(t, None)
+
+    def _own(self, scope):
+        if scope not in self.lists: self._write(scope, list(self.lists[DEFAULT_SCOPE]), [])
+        return self.lists[scope]
+
+    def get(self, scope):
+        with self.lock: return list(self.lists.get(scope, self.lists[DEFAULT_SCOPE]))
+
+    def add(self, scope, tickers):
+        with self.lock:
+            entries = self._own(scope)
+            added = list(dict.fromkeys(t for t in tickers if t not in entries))
+            if added: self._write(scope, added, [])
+        return added, [t for t in dict.fromkeys(tickers) if t not in added]
+
+    def remove(self, scope, tickers):
+        with self.lock:
+            entries = self._own(scope)
+            removed = list(dict.fromkeys(t for t in tickers if t in entries))
+            if removed: self._write(scope, [], removed)
+        return removed, [t for t in dict.fromkeys(tickers) if t not in removed]
+
+WATCHLISTS = WatchlistStore(WATCHLIST_DB, WATCHLIST_FILE)
+
+def watchlist_scope(channel):
+    guild = getattr(channel, "guild", None)
+    return str(guild.id) if guild else f"dm:{channel.id}"
+
+# --- FOURNISSEURS DE DONNÉES MARCHÉ (yfinance en prod, fixtures en replay/bench) ---
+OptionChain = namedtuple("OptionChain", "calls puts")
+
+class MarketDataProvider:
+    # Interface unique derrière tous les accès marché : history, download groupé, info, options, calendrier, insiders
+    def today(self): return datetime.date.today()
+    def history(self, symbol, period=None, interval="1d", start=None): raise NotImplementedError
+    def download(self, symbols, period=None, interval="1d", start=None): raise NotImplementedError
+    def info(self, symbol): raise NotImplementedError
+    def options(self, symbol): raise NotImplementedError
+    def option_chain(self, symbol, date): raise NotImplementedError
+    def calendar(self, symbol): raise NotImplementedError
+    def insider(self, symbol): raise NotImplementedError
+
+class YFinanceProvider(MarketDataProvider):
+    def history(self, symbol, period=None, interval="1d", start=None):
+        kwargs = {"start": start} if start else {"period": period or "1mo"}
+        return yf.Ticker(symbol).history(interval=interval, auto_adjust=True, **kwargs)
+
+    def download(self, symbols, period=None, interval="1d", start=None):
+        kwargs = {"start": start} if start else {"period": period or "1mo"}
+        raw = yf.download(symbols, interval=interval, group_by="ticker", auto_adjust=True, threads=True, progress=False, **kwargs)
+        frames = {}
+        for t in symbols:
+            try:
+                df = raw[t] if isinstance(raw.columns, pd.MultiIndex) else raw
+                df = df.dropna(subset=["Close"])
+                if not df.empty: frames[t] = df
+            except KeyError: continue
+        return frames
+
+    def info(self, symbol): return yf.Ticker(symbol).info
+    def options(self, symbol): return yf.Ticker(symbol).options
+    def option_chain(self, symbol, date):
+        opt = yf.Ticker(symbol).option_chain(date)
+        return OptionChain(opt.calls, opt.puts)
+    def calendar(self, symbol): return yf.Ticker(symbol).calendar
+    def insider(self, symbol): return yf.Ticker(symbol).insider_transactions
+
+def _fixture_name(symbol): return re.sub(r'[^A-Za-z0-9^._-]', '_', symbol)
+
+class FixtureProvider(MarketDataProvider):
+    # Rejoue des données enregistrées : <root>/<SYMBOLE>/history[_<interval>].csv, info.json, options.json,
+    # chain_<date>_calls.csv / _puts.csv, calendar.json, insider.csv ; <root>/manifest.json fixe la date "du jour"
+    def __init__(self, root, latency=0.0, jitter=0.0, seed=0):
+        self.root, self.latency, self.jitter = root, latency, jitter
+        self.rng, self.rng_lock = random.Random(seed), threading.Lock()
+        try:
+            with open(os.path.join(root, "manifest.json")) as f: self.as_of = datetime.date.fromisoformat(json.load(f)["as_of"])
+        except (OSError, ValueError, KeyError): self.as_of = None
+
+    def _wait(self):
+        if not self.latency and not self.jitter: return
+        with self.rng_lock: delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, delay))
+
+    def _path(self, symbol, name): return os.path.join(self.root, _fixture_name(symbol), name)
+
+    def _csv(self, symbol, name, index=True):
+        try: return pd.read_csv(self._path(symbol, name), index_col=0 if index else None, parse_dates=index)
+        except (OSError, ValueError): return pd.DataFrame()
+
+    def _json(self, symbol, name, default):
+        try:
+            with open(self._path(symbol, name)) as f: return json.load(f)
+        except (OSError, ValueError): return default
+
+    def today(self): return self.as_of or datetime.date.today()
+
+    def history(self, symbol, period=None, interval="1d", start=None):
+        self._wait()
+        df = self._csv(symbol, "history.csv" if interval == "1d" else f"history_{interval}.csv")
+        if df.empty: return df
+        if getattr(df.index, "tz", None) is not None: df.index = df.index.tz_localize(None)
+        end = pd.Timestamp(self.today()) + pd.Timedelta(days=1)
+        begin = pd.Timestamp(start) if start else end - pd.Timedelta(days=PERIOD_DAYS.get(period or "1mo", 1))
+        return df[(df.index >= begin) & (df.index < end)]
+
+    def download(self, symbols, period=None, interval="1d", start=None):
+        frames = {}
+        for t in symbols:
+            df = self.history(t, period, interval, start)
+            if not df.empty: frames[t] = df
+        return frames
+
+    def info(self, symbol): self._wait(); return self._json(symbol, "info.json", {})
+    def options(self, symbol): self._wait(); return tuple(self._json(symbol, "options.json", []))
+    def option_chain(self, symbol, date):
+        self._wait()
+        return OptionChain(self._csv(symbol, f"chain_{date}_calls.csv", False), self._csv(symbol, f"chain_{date}_puts.csv", False))
+    def calendar(self, symbol):
+        self._wait()
+        cal = self._json(symbol, "calendar.json", {})
+        if "Earnings Date" in cal: cal["Earnings Date"] = [datetime.date.fromisoformat(d) for d in cal["Earnings Date"]]
+        return cal
+    def insider(self, symbol): self._wait(); return self._csv(symbol, "insider.csv", False)
+
+class RecordingProvider(MarketDataProvider):
+    # Enveloppe un fournisseur réel et écrit chaque réponse au format FixtureProvider
+    def __init__(self, inner, root):
+        self.inner, self.root = inner, root
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, "manifest.json"), "w") as f: json.dump({"as_of": str(inner.today())}, f)
+
+    def _file(self, symbol, name):
+        os.makedirs(os.path.join(self.root, _fixture_name(symbol)), exist_ok=True)
+        return os.path.join(self.root, _fixture_name(symbol), name)
+
+    def _save_history(self, symbol, interval, df):
+        if df is None or df.empty: return
+        path = self._file(symbol, "history.csv" if interval == "1d" else f"history_{interval}.csv")
+        if os.path.exists(path):
+            old = pd.read_csv(path, index_col=0, parse_dates=True)
+            df = pd.concat([old[~old.index.isin(df.index)], df]).sort_index()
+        df.to_csv(path)
+
+    def today(self): return self.inner.today()
+
+    def history(self, symbol, period=None, interval="1d", start=None):
+        df = self.inner.history(symbol, period, interval, start)
+        if not df.empty:
+            idx = pd.DatetimeIndex(df.index)
+            self._save_history(symbol, interval, df.set_axis(idx.tz_localize(None) if idx.tz is not None else idx))
+        return df
+
+    def download(self, symbols, period=None, interval="1d", start=None):
+        frames = self.inner.download(symbols, period, interval, start)
+        for t, df in frames.items():
+            idx = pd.DatetimeIndex(df.index)
+            self._save_history(t, interval, df.set_axis(idx.tz_localize(None) if idx.tz is not None else idx))
+        return frames
+
+    def info(self, symbol):
+        info = self.inner.info(symbol)
+        with open(self._file(symbol, "info.json"), "w") as f: json.dump(info, f, default=str)
+        return info
+
+    def options(self, symbol):
+        dates = self.inner.options(symbol)
+        with open(self._file(symbol, "options.json"), "w") as f: json.dump(list(dates), f)
+        return dates
+
+    def option_chain(self, symbol, date):
+        chain = self.inner.option_chain(symbol, date)
+        chain.calls.to_csv(self._file(symbol, f"chain_{date}_calls.csv"), index=False)
+        chain.puts.to_csv(self._file(symbol, f"chain_{date}_puts.csv"), index=False)
+        return chain
+
+    def calendar(self, symbol):
+        cal = self.inner.calendar(symbol)
+        with open(self._file(symbol, "calendar.json"), "w") as f: json.dump(cal or {}, f, default=str)
+        return cal
+
+    def insider(self, symbol):
+        ins = self.inner.insider(symbol)
+        if ins is not None: ins.to_csv(self._file(symbol, "insider.csv"), index=False)
+        return ins
+
+class TracedProvider(MarketDataProvider):
+    # Chronomètre chaque endpoint du fournisseur sous "data.<endpoint>" (seuls les vrais appels, pas les hits du cache)
+    def __init__(self, inner): self.inner = inner
+
+    def _call(self, endpoint, *args):
+        with TRACER.span(f"data.{endpoint}"): return getattr(self.inner, endpoint)(*args)
+
+    def today(self): return self.inner.today()
+    def history(self, symbol, period=None, interval="1d", start=None): return self._call("history", symbol, period, interval, start)
+    def download(self, symbols, period=None, interval="1d", start=None): return self._call("download", symbols, period, interval, start)
+    def info(self, symbol): return self._call("info", symbol)
+    def options(self, symbol): return self._call("options", symbol)
+    def option_chain(self, symbol, date): return self._call("option_chain", symbol, date)
+    def calendar(self, symbol): return self._call("calendar", symbol)
+    def insider(self, symbol): return self._call("insider", symbol)
+
+def make_market_provider(spec):
+    # "yfinance" (défaut) | "fixture:<dossier>" | "record:<dossier>"
+    kind, _, arg = spec.partition(":")
+    if kind == "fixture": return TracedProvider(FixtureProvider(arg, PROVIDER_LATENCY, PROVIDER_JITTER))
+    if kind == "record": return TracedProvider(RecordingProvider(YFinanceProvider(), arg))
+    return TracedProvider(YFinanceProvider())
+
+PROVIDER = make_market_provider(os.getenv("MARKET_DATA_PROVIDER", "yfinance"))
+
+def market_today(): return PROVIDER.today()
+
+# --- CACHE MARCHÉ PARTAGÉ (TTL + LRU) ---
+def _sizeof(value):
+    if isinstance(value, pd.DataFrame): return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, tuple): return sum(_sizeof(v) for v in value)
+    if isinstance(value, (dict, list)): return sys.getsizeof(value) + len(repr(value))
+    return sys.getsizeof(value)
+
+class MarketDataCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.inflight = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def get(self, kind, key, loader):
+        k = (kind,) + key
+        with self.lock:
+            entry = self.entries.get(k)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(k)
+                self.stats["hits"] += 1
+                return entry[2]
+            fut = self.inflight.get(k)
+            owner = fut is None
+            if owner:
+                fut = self.inflight[k] = Future()
+                self.stats["misses"] += 1
+            else: self.stats["coalesced"] += 1
+        # Requêtes identiques simultanées -> un seul fetch
+        if not owner: return fut.result()
+        try:
+            value = loader()
+            self.put(kind, key, value)
+            fut.set_result(value)
+            return value
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self.lock: self.inflight.pop(k, None)
 
-def save_watchlist(watchlist):
-    with open(WATCHLIST_FILE, "w") as f:
-        json.dump(watchlist, f)
+    def peek(self, kind, key):
+        with self.lock:
+            entry = self.entries.get((kind,) + key)
+            if entry and entry[0] > time.monotonic():
+                self.stats["hits"] += 1
+                return entry[2]
+
+    def put(self, kind, key, value):
+        k, size = (kind,) + key, _sizeof(value)
+        with self.lock:
+            if k in self.entries: self.size -= self.entries.pop(k)[1]
+            self.entries[k] = (time.monotonic() + CACHE_TTL[kind], size, value)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, old_size, _) = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.stats["evictions"] += 1
+
+    def summary(self):
+        with self.lock:
+            s = dict(self.stats)
+            total = s["hits"] + s["misses"] + s["coalesced"]
+            s["hit_rate"] = (s["hits"] + s["coalesced"]) / total * 100 if total else 0
+            s["entries"], s["mb"] = len(self.entries), self.size / 1e6
+        return s
+
+MARKET_CACHE = MarketDataCache(CACHE_MAX_MB * 1e6)
+
+# --- STOCKAGE OHLCV LOCAL (NumPy memory-mapped, 1 fichier / symbole) ---
+PERIOD_DAYS = {"1mo": 31, "3mo": 93, "6mo": 186, "1y": 366, "2y": 731, "5y": 1827, "10y": 3653, "max": 36500}
+OHLCV_COLS = ["Open", "High", "Low", "Close", "Volume"]
+OHLCV_DTYPE = np.dtype([("Date", "M8[D]")] + [(c, "f8") for c in OHLCV_COLS])
+
+def _to_records(df):
+    idx = pd.DatetimeIndex(df.index)
+    if idx.tz is not None: idx = idx.tz_localize(None)
+    arr = np.empty(len(df), dtype=OHLCV_DTYPE)
+    arr["Date"] = idx.normalize().values.astype("M8[D]")
+    for c in OHLCV_COLS: arr[c] = df[c].to_numpy(dtype="f8")
+    return arr
+
+def _to_frame(arr):
+    df = pd.DataFrame({c: np.asarray(arr[c]) for c in OHLCV_COLS}, index=pd.DatetimeIndex(np.asarray(arr["Date"]).astype("M8[ns]"), name="Date"))
+    return df
+
+class OHLCVStore:
+    def __init__(self, root):
+        self.root = root
+        self.locks = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, symbol, ext):
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9^._-]', '_', symbol) + ext)
+
+    def _symbol_lock(self, symbol):
+        with self.lock: return self.locks.setdefault(symbol, threading.Lock())
+
+    def _read(self, symbol):
+        try:
+            with open(self._path(symbol, ".json")) as f: meta = json.load(f)
+            return np.load(self._path(symbol, ".npy"), mmap_mode="r"), meta
+        except (OSError, ValueError): return None, None
+
+    def _write(self, symbol, arr, meta):
+        # Écriture atomique : un crash ne laisse jamais un fichier à moitié écrit
+        for ext, dump in ((".npy", lambda f: np.save(f, arr)), (".json", lambda f: f.write(json.dumps(meta).encode()))):
+            if ext == ".npy" and arr is None: continue
+            path = self._path(symbol, ext)
+            with open(path + ".tmp", "wb") as f: dump(f)
+            os.replace(path + ".tmp", path)
+
+    def _plan(self, symbol, period):
+        # -> (arr, meta, start) : start=None si le stock local est frais, "" si un download complet est requis
+        arr, meta = self._read(symbol)
+        if arr is None or not len(arr) or PERIOD_DAYS.get(meta.get("period"), 0) < PERIOD_DAYS[period]: return arr, meta, ""
+        if time.time() - meta.get("checked", 0) < CACHE_TTL["history"]: return arr, meta, None
+        # Reprise au dernier bar *clôturé* : le dernier bar stocké peut être partiel (séance en cours, crypto 24/7)
+        return arr, meta, str(arr["Date"][-2 if len(arr) > 1 else -1])
+
+    def _merge(self, symbol, period, arr, meta, start, fresh):
+        if fresh is None or fresh.empty:
+            if start: self._write(symbol, None, dict(meta, checked=time.time()))
+            return arr
+        new = _to_records(fresh.dropna(subset=["Close"]))
+        if start:
+            # L'avant-dernier bar stocké (clôturé) est re-téléchargé : s'il a bougé (split/dividende ajusté), on recharge tout.
+            # Le dernier bar, éventuellement partiel, est toujours écrasé sans comparaison.
+            if len(arr) > 1:
+                ref = arr["Date"][-2]
+                old, cur = arr[arr["Date"] == ref], new[new["Date"] == ref]
+                if len(old) and len(cur) and abs(old["Close"][0] / cur["Close"][0] - 1) > 1e-3: return None
+            new = np.concatenate([arr[arr["Date"] < new["Date"][0]], new])
+        self._write(symbol, new, {"period": period if not start else meta["period"], "checked": time.time()})
+        return new
+
+    def _slice(self, arr, period):
+        if arr is None: return pd.DataFrame(columns=OHLCV_COLS)
+        cutoff = np.datetime64(market_today() - datetime.timedelta(days=PERIOD_DAYS[period]), "D")
+        return _to_frame(arr[arr["Date"] >= cutoff])
+
+    def history(self, symbol, period="1y"):
+        with self._symbol_lock(symbol):
+            arr, meta, start = self._plan(symbol, period)
+            if start is None: return self._slice(arr, period)
+            fresh = PROVIDER.history(symbol, start=start) if start else PROVIDER.history(symbol, period)
+            merged = self._merge(symbol, period, arr, meta, start, fresh)
+            if merged is None: merged = self._merge(symbol, period, None, None, "", PROVIDER.history(symbol, meta["period"]))
+            return self._slice(merged, period)
+
+    def batch(self, symbols, period="1y"):
+        # Un download groupé pour les symboles inconnus, un autre (depuis la date stockée la plus ancienne) pour les incréments
+        plans = {s: self._plan(s, period) for s in symbols}
+        full = [s for s, p in plans.items() if p[2] == ""]
+        stale = [s for s, p in plans.items() if p[2]]
+        fetched = {}
+        if full: fetched.update(PROVIDER.download(full, period=period))
+        if stale: fetched.update(PROVIDER.download(stale, start=min(plans[s][2] for s in stale)))
+        frames = {}
+        for s in symbols:
+            arr, meta, start = plans[s]
+            if start is not None:
+                with self._symbol_lock(s):
+                    fresh = fetched.get(s)
+                    if start and fresh is not None: fresh = fresh[fresh.index >= pd.Timestamp(start)]
+                    arr = self._merge(s, period, arr, meta, start, fresh)
+                if arr is None:
+                    frames[s] = self.history(s, period)
+                    continue
+            df = self._slice(arr, period)
+            if not df.empty: frames[s] = df
+        return frames
+
+OHLCV_STORE = OHLCVStore(os.path.join(DATA_DIR, "ohlcv"))
+
+class CachedTicker:
+    # Même interface que yf.Ticker, mais chaque endpoint passe par MARKET_CACHE puis PROVIDER
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    def history(self, period="1mo", interval="1d"):
+        if interval == "1d" and period in PERIOD_DAYS: loader = lambda: OHLCV_STORE.history(self.ticker, period)
+        else: loader = lambda: PROVIDER.history(self.ticker, period, interval)
+        return MARKET_CACHE.get("history", (self.ticker, period, interval), loader).copy()
+
+    @property
+    def info(self): return MARKET_CACHE.get("info", (self.ticker,), lambda: PROVIDER.info(self.ticker))
+
+    @property
+    def options(self): return MARKET_CACHE.get("options", (self.ticker,), lambda: PROVIDER.options(self.ticker))
+
+    def option_chain(self, date): return MARKET_CACHE.get("chain", (self.ticker, date), lambda: PROVIDER.option_chain(self.ticker, date))
+
+    @property
+    def calendar(self): return MARKET_CACHE.get("calendar", (self.ticker,), lambda: PROVIDER.calendar(self.ticker))
+
+    @property
+    def insider_transactions(self): return MARKET_CACHE.get("insider", (self.ticker,), lambda: PROVIDER.insider(self.ticker))
 
 COMMON_TYPOS = {
     "APPL": "AAPL", "APPLE": "AAPL", 
@@ -84,86 +900,588 @@ COMMON_TYPOS = {
     "GOLD": "GLD", "SILVER": "SLV"
 }
 
+# --- RÉSOLUTION DES SYMBOLES (annuaire local + index exact / préfixe / SymSpell) ---
+SYMBOL_DIRECTORY_URL = os.getenv("SYMBOL_DIRECTORY_URL", "https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqtraded.txt")
+SYMBOL_DIRECTORY_FILE = os.path.join(DATA_DIR, "symbols.json")
+SYMBOL_REFRESH_DAYS = 7
+CRYPTO_BASES = ("BTC", "ETH", "XRP", "SOL", "ADA", "DOGE", "SHIB", "DOT", "LINK", "AVAX", "MATIC", "LTC", "BNB", "TRX", "TON",
+                "XLM", "BCH", "UNI", "ATOM", "XMR", "ETC", "FIL", "APT", "ARB", "OP", "NEAR", "ICP", "HBAR", "VET", "PEPE", "SUI")
+INDEX_SYMBOLS = {"^GSPC": "S&P 500", "^NDX": "Nasdaq 100", "^IXIC": "Nasdaq Composite", "^DJI": "Dow Jones", "^RUT": "Russell 2000",
+                 "^VIX": "CBOE Volatility", "^TNX": "US 10Y Yield", "^FTSE": "FTSE 100", "^GDAXI": "DAX", "^FCHI": "CAC 40",
+                 "^STOXX50E": "Euro Stoxx 50", "^N225": "Nikkei 225", "^HSI": "Hang Seng"}
+# Formes explicites hors annuaire US (crypto cotée dans une devise, place étrangère, indice) : acceptées telles quelles
+EXPLICIT_SYMBOLS = ((re.compile(r'^[A-Z0-9]+-(USD|USDT|EUR)$'), "CRYPTOCURRENCY"), (re.compile(r'^[A-Z0-9-]+\.[A-Z]{1,3}$'), "EQUITY"),
+                    (re.compile(r'^\^[A-Z0-9]+$'), "INDEX"))
+Resolved = namedtuple("Resolved", "symbol kind match")  # match : exact | alias | explicit | fuzzy | unchecked
+
+def _deletes(word, depth):
+    out = frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out = out | frontier
+    return out
+
+def _edit_distance(a, b):
+    # Damerau-Levenshtein restreinte (transpositions adjacentes comptées 1 : "MSTF" -> "MSFT")
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]: cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+def _parse_nasdaq_directory(text):
+    # nasdaqtraded.txt : "Nasdaq Traded|Symbol|Security Name|...|ETF|...|Test Issue|..." + ligne finale "File Creation Time"
+    lines = text.splitlines()
+    head = lines[0].split("|")
+    col = {name: i for i, name in enumerate(head)}
+    entries = {}
+    for line in lines[1:]:
+        f = line.split("|")
+        if len(f) != len(head) or f[col["Test Issue"]] == "Y": continue
+        sym = f[col["Symbol"]].strip()
+        if sym and "$" not in sym: entries[sym.replace(".", "-")] = ("ETF" if f[col["ETF"]] == "Y" else "EQUITY", f[col["Security Name"]])
+    return entries
+
+class TickerResolver:
+    # Tout se résout en mémoire avant le moindre appel réseau : dict exact, liste triée (préfixe), index de suppressions (SymSpell)
+    def __init__(self, path):
+        self.path, self.mtime = path, None
+        self.symbols = {}  # symbole -> (type, nom)
+        self.deletes = {}  # variante à 1-2 suppressions -> clés (symboles + alias COMMON_TYPOS)
+        self.keys = []     # clés triées
+        self.ready = False
+
+    def _build(self, entries):
+        symbols = dict(entries)
+        symbols.update({f"{b}-USD": ("CRYPTOCURRENCY", b) for b in CRYPTO_BASES})
+        symbols.update({s: ("INDEX", n) for s, n in INDEX_SYMBOLS.items()})
+        keys = set(symbols) | set(COMMON_TYPOS)
+        deletes = {}
+        for k in keys:
+            for d in _deletes(k, 1 if len(k) <= 4 else 2): deletes.setdefault(d, []).append(k)
+        self.symbols, self.deletes, self.keys, self.ready = symbols, deletes, sorted(keys), True
+
+    def load(self):
+        # Annuaire rafraîchi tous les SYMBOL_REFRESH_DAYS jours ; réseau KO -> dernière copie locale, sinon mode permissif
+        stale = not os.path.exists(self.path) or time.time() - os.path.getmtime(self.path) > SYMBOL_REFRESH_DAYS * 86400
+        if stale:
+            try:
+                with TRACER.span("resolver.download"):
+                    req = urllib.request.Request(SYMBOL_DIRECTORY_URL, headers={"User-Agent": "Mozilla/5.0"})
+                    with urllib.request.urlopen(req, timeout=30) as r: entries = _parse_nasdaq_directory(r.read().decode("utf-8", "replace"))
+                if entries:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with open(self.path + ".tmp", "w") as f: json.dump(entries, f)
+                    os.replace(self.path + ".tmp", self.path)
+            except Exception as e: print(f"Annuaire des symboles indisponible : {e}", flush=True)
+        if not os.path.exists(self.path) or os.path.getmtime(self.path) == self.mtime: return
+        with open(self.path) as f: entries = {k: tuple(v) for k, v in json.load(f).items()}
+        self._build(entries)
+        self.mtime = os.path.getmtime(self.path)
+
+    def fuzzy(self, q, limit=1):
+        if len(q) < 3 or not self.ready: return []
+        depth = 1 if len(q) <= 4 else 2
+        cands = {k for d in _deletes(q, depth) for k in self.deletes.get(d, ())}
+        # À distance égale : symboles cotés avant les alias (sinon LOL -> POL -> MATIC-USD)
+        scored = sorted((_edit_distance(q, k), k not in self.symbols, abs(len(k) - len(q)), k) for k in cands)
+        return list(dict.fromkeys(COMMON_TYPOS.get(k, k) for dist, _, _, k in scored if dist <= depth))[:limit]
+
+    def prefix(self, q, limit=5):
+        i = bisect.bisect_left(self.keys, q)
+        out = []
+        while i < len(self.keys) and self.keys[i].startswith(q) and len(out) < limit:
+            out.append(COMMON_TYPOS.get(self.keys[i], self.keys[i]))
+            i += 1
+        return out
+
+    def resolve(self, text):
+        q = text.upper().strip()
+        alias = q in COMMON_TYPOS
+        if alias: q = COMMON_TYPOS[q]
+        if not self.ready: return Resolved(q, None, "alias" if alias else "unchecked")
+        for s in (q, q.replace(".", "-")):
+            if s in self.symbols: return Resolved(s, self.symbols[s][0], "alias" if alias else "exact")
+        if alias: return Resolved(q, None, "alias")
+        if f"{q}-USD" in self.symbols: return Resolved(f"{q}-USD", "CRYPTOCURRENCY", "exact")
+        for pattern, kind in EXPLICIT_SYMBOLS:
+            if pattern.match(q): return Resolved(q, kind, "explicit")
+        best = self.fuzzy(q)
+        return Resolved(best[0], self.symbols.get(best[0], (None,))[0], "fuzzy") if best else None
+
+    def suggest(self, text, limit=3):
+        q = text.upper().strip()
+        return list(dict.fromkeys(self.fuzzy(q, limit) + self.prefix(q, limit)))[:limit]
+
+RESOLVER = TickerResolver(SYMBOL_DIRECTORY_FILE)
+
 # --- OUTILS FINANCIERS AVANCÉS ---
 def create_ascii_bar(value, max_val=100, length=10):
     try:
         val = int(value)
         filled = int((val / max_val) * length)
         return f"[`{'█' * filled}{'░' * (length - filled)}`]"
-    except: return "[`░░░░░░░░░░`]"
+    except (TypeError, ValueError): return "[`░░░░░░░░░░`]"
 
+@traced("macro")
 def get_market_context():
     try:
-        spy = yf.Ticker("SPY").history(period="1y")
-        vix = yf.Ticker("^VIX").history(period="1d")
+        spy = CachedTicker("SPY").history(period="1y")
+        vix = CachedTicker("^VIX").history(period="1d")
         if spy.empty or vix.empty: return "Unknown"
         trend = "BULLISH 🟢" if spy['Close'].iloc[-1] > spy['Close'].rolling(200).mean().iloc[-1] else "BEARISH 🔴"
         return f"SPY: {trend} | VIX: {vix['Close'].iloc[-1]:.2f}"
-    except: return "Macro N/A"
+    except Exception as e:
+        TRACER.error("macro", e)
+        return "Macro N/A"
 
-def get_smart_money_data(stock, quote_type):
-    insider_status = "⚪ NEUTRAL"
-    pc_ratio = "N/A"
-    earnings_date = "N/A"
-    
-    if quote_type == "EQUITY":
-        try:
-            ins = stock.insider_transactions
-            if ins is not None and not ins.empty:
-                recent = ins.head(10)
-                buys = recent[recent['Text'].str.contains("Purchase", case=False, na=False)].shape[0]
-                sells = recent[recent['Text'].str.contains("Sale", case=False, na=False)].shape[0]
-                if buys > sells: insider_status = "🟢 BUYING"
-                elif sells > buys + 2: insider_status = "🔴 SELLING"
-        except: pass
-        
-        try:
-            dates = stock.options
-            if dates:
-                opt = stock.option_chain(dates[0])
-                vol_c = opt.calls['volume'].sum()
-                vol_p = opt.puts['volume'].sum()
-                if vol_c > 0: pc_ratio = f"{vol_p / vol_c:.2f}"
-        except: pass
-        
+def batch_history(tickers, period="1y"):
+    # Cache mémoire -> stock disque -> un seul download multi-tickers pour le reste
+    frames = {}
+    for t in tickers:
+        df = MARKET_CACHE.peek("history", (t, period, "1d"))
+        if df is not None and not df.empty: frames[t] = df.copy()
+    missing = [t for t in tickers if t not in frames]
+    if not missing: return frames
+    for t, df in OHLCV_STORE.batch(missing, period).items():
+        MARKET_CACHE.put("history", (t, period, "1d"), df)
+        frames[t] = df.copy()
+    return frames
+
+# --- ANALYTIQUE OPTIONS (toutes les échéances en parallèle, P/C pondérés, max pain, activité inhabituelle) ---
+OPTIONS_WORKERS = int(os.getenv("OPTIONS_WORKERS", 32))
+OPTIONS_HORIZON_DAYS = int(os.getenv("OPTIONS_HORIZON_DAYS", 120))   # échéances au-delà ignorées (LEAPS : peu de flux, beaucoup d'appels)
+OPTIONS_MAX_EXPIRIES = int(os.getenv("OPTIONS_MAX_EXPIRIES", 10))
+OPTIONS_UNUSUAL_RATIO = float(os.getenv("OPTIONS_UNUSUAL_RATIO", 3))  # volume du jour > 3x l'open interest du strike
+OPTIONS_UNUSUAL_MIN_VOL = int(os.getenv("OPTIONS_UNUSUAL_MIN_VOL", 1000))
+OPTIONS_POOL = ThreadPoolExecutor(max_workers=OPTIONS_WORKERS, thread_name_prefix="options")
+OptionsFlow = namedtuple("OptionsFlow", "pc_volume pc_oi term max_pain unusual")  # term : ((échéance, P/C vol, P/C OI), ...)
+Unusual = namedtuple("Unusual", "side strike expiry volume oi")
+OPTIONS_EMPTY = OptionsFlow(np.nan, np.nan, (), np.nan, ())
+
+def _ratio(num, den):
+    return float(num / den) if den > 0 else np.nan
+
+def _fmt(x, spec=".2f"): return format(x, spec) if np.isfinite(x) else "N/A"
+
+def options_flow(chains, dates):
+    # Chaînes concaténées en colonnes (échéance, put, strike, volume, OI) : tous les agrégats en une passe NumPy
+    parts = []
+    for e, chain in enumerate(chains):
+        if chain is None: continue
+        for put, side in ((0.0, chain.calls), (1.0, chain.puts)):
+            if side is None or side.empty: continue
+            cols = side.reindex(columns=["strike", "volume", "openInterest"]).to_numpy(dtype=float)
+            parts.append(np.column_stack([np.full(len(cols), e, dtype=float), np.full(len(cols), put), cols]))
+    if not parts: return OPTIONS_EMPTY
+    e, put, strike, vol, oi = np.concatenate(parts).T
+    e, put = e.astype(int), put.astype(bool)
+    # NaN = volume/OI non publié : compté 0 dans les agrégats, mais jamais pris pour un OI réel dans les tests par strike
+    known = np.isfinite(strike) & np.isfinite(oi) & (oi > 0)
+
+    # Structure par terme : volumes et OI par (échéance, call/put) via bincount
+    slot = e * 2 + put
+    v = np.bincount(slot, np.nan_to_num(vol), 2 * len(dates)).reshape(-1, 2)
+    o = np.bincount(slot, np.nan_to_num(oi), 2 * len(dates)).reshape(-1, 2)
+    term = tuple((dates[i], _ratio(v[i, 1], v[i, 0]), _ratio(o[i, 1], o[i, 0])) for i in range(len(dates)) if v[i].sum() + o[i].sum() > 0)
+
+    # Max pain de la première échéance avec de l'OI : strike qui minimise la valeur intrinsèque totale payée aux acheteurs
+    max_pain = np.nan
+    front = [i for i in range(len(dates)) if o[i].sum() > 0]
+    if front:
+        m = (e == front[0]) & known
+        k, q, p = strike[m], oi[m], put[m]
+        settle = np.unique(k)[:, None]
+        pain = (np.maximum(settle - k, 0) * q * ~p).sum(axis=1) + (np.maximum(k - settle, 0) * q * p).sum(axis=1)
+        max_pain = float(settle[np.argmin(pain), 0])
+
+    # Activité inhabituelle : volume du jour très supérieur à l'OI du strike (positions nouvelles), top 3 par volume
+    # Sans OI publié (NaN ou 0) le ratio n'a pas de sens : un strike sans OI ne doit pas ressortir en "1000x OI"
+    hot = np.flatnonzero(known & (vol >= OPTIONS_UNUSUAL_MIN_VOL) & (vol > OPTIONS_UNUSUAL_RATIO * oi))
+    hot = hot[np.argsort(-vol[hot], kind="stable")][:3]
+    unusual = tuple(Unusual("P" if put[i] else "C", float(strike[i]), dates[e[i]], int(vol[i]), int(oi[i])) for i in hot)
+    return OptionsFlow(_ratio(v[:, 1].sum(), v[:, 0].sum()), _ratio(o[:, 1].sum(), o[:, 0].sum()), term, max_pain, unusual)
+
+def _safe_chain(stock, date):
+    # Une échéance en échec ne fait pas tomber les autres
+    try: return stock.option_chain(date)
+    except Exception as e:
+        TRACER.error("options.chain", e)
+        return None
+
+def _options_flow(stock):
+    dates = stock.options
+    if not dates: return OPTIONS_EMPTY
+    today = market_today()
+    keep = [d for d in dates if (datetime.date.fromisoformat(d) - today).days <= OPTIONS_HORIZON_DAYS][:OPTIONS_MAX_EXPIRIES] or list(dates[:1])
+    # Toutes les échéances en vol en même temps (MARKET_CACHE coalesce les doublons entre terminal et scanner)
+    chains = list(OPTIONS_POOL.map(functools.partial(_safe_chain, stock), keep))
+    return options_flow(chains, keep)
+
+def unusual_label(u):
+    return f"{u.side}{u.strike:g} {u.expiry[5:]} {u.volume / max(u.oi, 1):.1f}x OI"
+
+def options_prompt(flow):
+    # Résumé compact pour le LLM (et la clé de cache du mémo)
+    if not flow.term: return "N/A"
+    term = f"{_fmt(flow.term[0][1])}->{_fmt(flow.term[-1][1])}" if len(flow.term) > 1 else _fmt(flow.term[0][1])
+    out = f"P/C vol {_fmt(flow.pc_volume)}, P/C OI {_fmt(flow.pc_oi)}, term {term}, max pain {_fmt(flow.max_pain, 'g')}"
+    if flow.unusual: out += ", unusual " + "; ".join(unusual_label(u) for u in flow.unusual)
+    return out
+
+def options_field(flow):
+    # Lignes du champ "Flow / Events" du terminal
+    if not flow.term: return "`P/C   `: N/A"
+    lines = [f"`P/C   `: {_fmt(flow.pc_volume)} vol | {_fmt(flow.pc_oi)} OI"]
+    if len(flow.term) > 1: lines.append(f"`TERM  `: {_fmt(flow.term[0][1])} ➔ {_fmt(flow.term[-1][1])}")
+    if np.isfinite(flow.max_pain): lines.append(f"`PAIN  `: ${flow.max_pain:g}")
+    if flow.unusual: lines.append(f"`UOA   `: {unusual_label(flow.unusual[0])}")
+    return "\n".join(lines)
+
+# --- SMART MONEY (insiders, options, earnings : sources parallèles, champs à la demande) ---
+SMART_MONEY_WORKERS = int(os.getenv("SMART_MONEY_WORKERS", 8))
+SMART_MONEY_FIELDS = ("insider", "options", "earnings")
+SMART_MONEY_DEFAULTS = {"insider": "⚪ NEUTRAL", "options": OPTIONS_EMPTY, "earnings": "N/A"}
+SMART_MONEY_TTL = {
+    "insider": int(os.getenv("SMART_MONEY_TTL_INSIDER", 24 * 3600)),
+    "options": int(os.getenv("SMART_MONEY_TTL_PC", 900)),
+    "earnings": int(os.getenv("SMART_MONEY_TTL_EARNINGS", 12 * 3600)),
+}
+
+def _insider_status(stock):
+    ins = stock.insider_transactions
+    if ins is None or ins.empty: return SMART_MONEY_DEFAULTS["insider"]
+    recent = ins.head(10)
+    buys = recent[recent['Text'].str.contains("Purchase", case=False, na=False)].shape[0]
+    sells = recent[recent['Text'].str.contains("Sale", case=False, na=False)].shape[0]
+    if buys > sells: return "🟢 BUYING"
+    if sells > buys + 2: return "🔴 SELLING"
+    return SMART_MONEY_DEFAULTS["insider"]
+
+def _earnings_date(stock):
+    cal = stock.calendar
+    if cal and 'Earnings Date' in cal:
+        edate = cal['Earnings Date'][0]
+        if pd.notna(edate): return edate.strftime('%Y-%m-%d')
+    return SMART_MONEY_DEFAULTS["earnings"]
+
+class SmartMoneyService:
+    SOURCES = {"insider": _insider_status, "options": _options_flow, "earnings": _earnings_date}
+
+    def __init__(self, workers):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smart")
+        self.values = {}  # (ticker, champ) -> (expire_à, valeur) : fraîcheur propre à chaque champ
+        self.lock = threading.Lock()
+
+    def _fetch(self, field, stock):
+        # Source en échec -> valeur par défaut non mise en cache (retentée au prochain appel) ; l'erreur est comptée par le span
         try:
-            cal = stock.calendar
-            if cal and 'Earnings Date' in cal:
-                edate = cal['Earnings Date'][0]
-                if pd.notna(edate): earnings_date = edate.strftime('%Y-%m-%d')
-        except: pass
+            with TRACER.span(f"smart_money.{field}"): value = self.SOURCES[field](stock)
+        except Exception: return SMART_MONEY_DEFAULTS[field]
+        with self.lock:
+            self.values[(stock.ticker, field)] = (time.monotonic() + SMART_MONEY_TTL[field], value)
+        return value
+
+    def get(self, stock, quote_type, fields=SMART_MONEY_FIELDS):
+        out = {f: SMART_MONEY_DEFAULTS[f] for f in SMART_MONEY_FIELDS}
+        # Insiders / earnings : actions seulement ; les ETF ont aussi des chaînes d'options (SPY, QQQ...)
+        if quote_type == "ETF": fields = [f for f in fields if f == "options"]
+        elif quote_type != "EQUITY": return out
+        now, todo = time.monotonic(), []
+        with self.lock:
+            for f in fields:
+                hit = self.values.get((stock.ticker, f))
+                if hit and hit[0] > now: out[f] = hit[1]
+                else: todo.append(f)
+            if len(self.values) > 20000:
+                for k in [k for k, (exp, _) in self.values.items() if exp <= now]: del self.values[k]
+        if not todo: return out
+        # Sources indépendantes : toutes lancées en parallèle, la première tourne dans le thread appelant
+        futures = {f: self.pool.submit(self._fetch, f, stock) for f in todo[1:]}
+        out[todo[0]] = self._fetch(todo[0], stock)
+        for f, fut in futures.items(): out[f] = fut.result()
+        return out
+
+SMART_MONEY = SmartMoneyService(SMART_MONEY_WORKERS)
+
+@traced("smart_money")
+def get_smart_money_data(stock, quote_type, fields=SMART_MONEY_FIELDS):
+    # -> (insider, OptionsFlow, earnings) ; les champs non demandés restent à leur valeur par défaut
+    data = SMART_MONEY.get(stock, quote_type, fields)
+    return data["insider"], data["options"], data["earnings"]
+
+# --- MOTEUR D'INDICATEURS VECTORISÉ (symboles x jours) ---
+SUMMARY_DTYPE = np.dtype([("Price", "f8"), ("SMA200", "f8"), ("Trend_Up", "?"), ("RSI", "f8"), ("BB_Width", "f8"),
+                          ("Squeeze", "?"), ("MaxDD", "f8"), ("Whale_Z", "f8")])
+Indicators = namedtuple("Indicators", "summary sma50 sma200 rsi bb_width whale_z")
+
+def frames_to_matrix(frames, length=None):
+    # Aligne les historiques à droite (dernier bar = dernière colonne), NaN en padding à gauche
+    T = max((len(df) for df in frames), default=0)
+    if length: T = min(T, length)
+    close, volume = np.full((len(frames), T), np.nan), np.full((len(frames), T), np.nan)
+    for i, df in enumerate(frames):
+        n = min(len(df), T)
+        if not n: continue
+        close[i, T - n:] = df['Close'].to_numpy(dtype="f8")[-n:]
+        volume[i, T - n:] = df['Volume'].to_numpy(dtype="f8")[-n:]
+    return close, volume
+
+def _rolling(x, w, fn):
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] >= w: out[:, w - 1:] = fn(np.lib.stride_tricks.sliding_window_view(x, w, axis=1))
+    return out
+
+def rolling_mean(x, w): return _rolling(x, w, lambda v: v.mean(axis=-1))
+
+def rolling_std(x, w): return _rolling(x, w, lambda v: v.std(axis=-1, ddof=1))
+
+@traced("indicators")
+def compute_indicators(close, volume):
+    # Mêmes formules que l'ancien calculate_metrics pandas, en une passe NumPy pour tous les symboles
+    S, T = close.shape
+    if not T: return Indicators(np.zeros(S, dtype=SUMMARY_DTYPE), *(np.empty((S, 0)),) * 5)
+    pad = np.arange(T)[None, :] < np.argmax(~np.isnan(close), axis=1)[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sma50, sma200 = rolling_mean(close, 50), rolling_mean(close, 200)
+
+        delta = np.full(close.shape, np.nan)
+        delta[:, 1:] = np.diff(close, axis=1)
+        gain, loss = np.where(delta > 0, delta, 0.0), np.where(delta < 0, -delta, 0.0)
+        gain[pad], loss[pad] = np.nan, np.nan
+        rsi = 100 - (100 / (1 + rolling_mean(gain, 14) / rolling_mean(loss, 14)))
+
+        sma20, std20 = rolling_mean(close, 20), rolling_std(close, 20)
+        bb_width = ((sma20 + 2 * std20) - (sma20 - 2 * std20)) / sma20
+
+        vol_mean, vol_std = rolling_mean(volume, 20), rolling_std(volume, 20)
+        whale_z = np.where(vol_std == 0, 0.0, (volume - vol_mean) / vol_std)
+
+        drawdown = close / np.fmax.accumulate(close, axis=1) - 1
+        max_dd = np.where(np.isnan(drawdown), np.inf, drawdown).min(axis=1, initial=np.inf) * 100
+        max_dd[np.isinf(max_dd)] = np.nan
+
+    summary = np.zeros(S, dtype=SUMMARY_DTYPE)
+    price = close[:, -1]
+    summary["Price"] = price
+    summary["SMA200"] = np.where(np.isnan(sma200[:, -1]), price, sma200[:, -1])
+    summary["Trend_Up"] = price > summary["SMA200"]
+    summary["RSI"] = np.where(np.isnan(rsi[:, -1]), 50, rsi[:, -1])
+    summary["BB_Width"] = bb_width[:, -1]
+    summary["Squeeze"] = bb_width[:, -1] < 0.05
+    summary["MaxDD"] = max_dd
+    summary["Whale_Z"] = whale_z[:, -1]
+    return Indicators(summary, sma50, sma200, rsi, bb_width, whale_z)
+
+# --- INDICATEURS EN STREAMING (état O(1) par symbole, mise à jour O(1) par bar) ---
+class RollingWindow:
+    # Moyenne / écart-type glissants (Welford), recalculés à chaque tour de fenêtre pour éviter la dérive
+    def __init__(self, window):
+        self.window, self.values = window, deque(maxlen=window)
+        self.mean, self.m2, self.pushes = 0.0, 0.0, 0
+
+    def _add(self, x):
+        n = len(self.values)
+        d = x - self.mean
+        self.mean += d / n
+        self.m2 += d * (x - self.mean)
+
+    def _remove(self, x):
+        n = len(self.values)
+        if n == 0: self.mean, self.m2 = 0.0, 0.0; return
+        d = x - self.mean
+        self.mean -= d / n
+        self.m2 -= d * (x - self.mean)
+
+    def _recompute(self):
+        n = len(self.values)
+        self.mean = sum(self.values) / n if n else 0.0
+        self.m2 = sum((v - self.mean) ** 2 for v in self.values)
+
+    def push(self, x):
+        if len(self.values) == self.window:
+            old = self.values.popleft()
+            self._remove(old)
+        self.values.append(x)
+        self._add(x)
+        self.pushes += 1
+        if self.pushes % self.window == 0: self._recompute()
+
+    def replace_last(self, x):
+        if not self.values: return self.push(x)
+        old = self.values.pop()
+        self._remove(old)
+        self.values.append(x)
+        self._add(x)
+
+    def full(self): return len(self.values) == self.window
+
+    def value(self): return self.mean if self.full() else float("nan")
+
+    def std(self): return (max(self.m2, 0.0) / (self.window - 1)) ** 0.5 if self.full() else float("nan")
+
+    def to_dict(self): return {"window": self.window, "values": list(self.values), "pushes": self.pushes}
+
+    @classmethod
+    def from_dict(cls, d):
+        w = cls(d["window"])
+        w.values.extend(d["values"])
+        w.pushes = d["pushes"]
+        w._recompute()
+        return w
+
+class StreamingRSI:
+    # wilder=False reproduit le RSI du terminal (moyennes simples sur 14 bars), wilder=True le lissage de Wilder
+    def __init__(self, period=14, wilder=False):
+        self.period, self.wilder = period, wilder
+        self.gains, self.losses = RollingWindow(period), RollingWindow(period)
+        self.prev_close, self.last_close = None, None
+        self.avg, self.prev_avg, self.n = None, None, 0
+
+    def _delta(self, close):
+        d = close - self.prev_close if self.prev_close is not None else 0.0
+        return max(d, 0.0), max(-d, 0.0)
+
+    def _wilder(self, g, l):
+        if self.n < self.period: return None
+        if self.avg is None: return (self.gains.mean, self.losses.mean)
+        return ((self.avg[0] * (self.period - 1) + g) / self.period, (self.avg[1] * (self.period - 1) + l) / self.period)
+
+    def push(self, close):
+        self.prev_close = self.last_close
+        self.last_close = close
+        g, l = self._delta(close)
+        self.gains.push(g); self.losses.push(l)
+        self.n += 1
+        self.prev_avg = self.avg
+        if self.wilder: self.avg = self._wilder(g, l)
+
+    def replace_last(self, close):
+        if self.last_close is None: return self.push(close)
+        self.last_close = close
+        g, l = self._delta(close)
+        self.gains.replace_last(g); self.losses.replace_last(l)
+        if self.wilder:
+            self.avg = self.prev_avg
+            self.avg = self._wilder(g, l)
+
+    def value(self):
+        if self.wilder: g, l = self.avg if self.avg else (float("nan"), float("nan"))
+        else: g, l = self.gains.value(), self.losses.value()
+        if g != g or l != l: return float("nan")
+        if l == 0: return 100.0 if g > 0 else float("nan")
+        return 100 - 100 / (1 + g / l)
+
+    def to_dict(self):
+        return {"period": self.period, "wilder": self.wilder, "gains": self.gains.to_dict(), "losses": self.losses.to_dict(),
+                "prev_close": self.prev_close, "last_close": self.last_close, "avg": self.avg, "prev_avg": self.prev_avg, "n": self.n}
+
+    @classmethod
+    def from_dict(cls, d):
+        r = cls(d["period"], d["wilder"])
+        r.gains, r.losses = RollingWindow.from_dict(d["gains"]), RollingWindow.from_dict(d["losses"])
+        r.prev_close, r.last_close, r.n = d["prev_close"], d["last_close"], d["n"]
+        r.avg = tuple(d["avg"]) if d["avg"] else None
+        r.prev_avg = tuple(d["prev_avg"]) if d["prev_avg"] else None
+        return r
+
+class StreamingDrawdown:
+    def __init__(self):
+        self.peak, self.max_dd = None, 0.0
+        self.prev = (None, 0.0)  # état avant le dernier bar, pour replace_last
 
-    return insider_status, pc_ratio, earnings_date
+    def push(self, close):
+        self.prev = (self.peak, self.max_dd)
+        self._apply(close)
 
-def calculate_metrics(stock, df):
+    def replace_last(self, close):
+        self.peak, self.max_dd = self.prev
+        self._apply(close)
+
+    def _apply(self, close):
+        self.peak = close if self.peak is None else max(self.peak, close)
+        self.max_dd = min(self.max_dd, close / self.peak - 1)
+
+    def value(self): return self.max_dd * 100
+
+    def to_dict(self): return {"peak": self.peak, "max_dd": self.max_dd, "prev": list(self.prev)}
+
+    @classmethod
+    def from_dict(cls, d):
+        dd = cls()
+        dd.peak, dd.max_dd, dd.prev = d["peak"], d["max_dd"], tuple(d["prev"])
+        return dd
+
+class SymbolStream:
+    # Tous les indicateurs du terminal pour un symbole ; update() avec la même date = bar en cours mis à jour
+    def __init__(self):
+        self.sma20, self.sma50, self.sma200 = RollingWindow(20), RollingWindow(50), RollingWindow(200)
+        self.rsi, self.dd, self.vol = StreamingRSI(14), StreamingDrawdown(), RollingWindow(20)
+        self.close, self.volume, self.date = None, None, None
+
+    def update(self, close, volume, date=None):
+        new_bar = date is None or date != self.date
+        for ind, x in ((self.sma20, close), (self.sma50, close), (self.sma200, close), (self.rsi, close), (self.dd, close), (self.vol, volume)):
+            if new_bar: ind.push(x)
+            else: ind.replace_last(x)
+        self.close, self.volume, self.date = close, volume, date
+
+    @classmethod
+    def seed(cls, df):
+        st = cls()
+        for d, c, v in zip(df.index, df['Close'].to_numpy(dtype="f8"), df['Volume'].to_numpy(dtype="f8")): st.update(c, v, str(d.date()))
+        return st
+
+    def snapshot(self):
+        sma200 = self.sma200.value()
+        m, sd = self.sma20.value(), self.sma20.std()
+        bb = ((m + 2 * sd) - (m - 2 * sd)) / m if m == m else float("nan")
+        vm, vs = self.vol.value(), self.vol.std()
+        rsi = self.rsi.value()
+        return {
+            "Price": self.close, "SMA20": m, "SMA50": self.sma50.value(), "SMA200": sma200,
+            "Trend": "UP 🐂" if self.close > (sma200 if sma200 == sma200 else self.close) else "DOWN 🐻",
+            "RSI": rsi if rsi == rsi else 50, "BB_Width": bb, "Squeeze": bb < 0.05, "MaxDD": self.dd.value(),
+            "Whale_Z": 0.0 if vs == 0 else (self.volume - vm) / vs,
+        }
+
+    def to_dict(self):
+        d = {k: getattr(self, k).to_dict() for k in ("sma20", "sma50", "sma200", "rsi", "dd", "vol")}
+        d.update(close=self.close, volume=self.volume, date=self.date)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls()
+        st.sma20, st.sma50, st.sma200, st.vol = (RollingWindow.from_dict(d[k]) for k in ("sma20", "sma50", "sma200", "vol"))
+        st.rsi, st.dd = StreamingRSI.from_dict(d["rsi"]), StreamingDrawdown.from_dict(d["dd"])
+        st.close, st.volume, st.date = d["close"], d["volume"], d["date"]
+        return st
+
+def save_streams(streams, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump({t: st.to_dict() for t, st in streams.items()}, f)
+    os.replace(tmp, path)
+
+def load_streams(path):
+    try:
+        with open(path) as f: return {t: SymbolStream.from_dict(d) for t, d in json.load(f).items()}
+    except (OSError, ValueError, KeyError): return {}
+
+@traced("metrics")
+def calculate_metrics(stock, df, ind=None, i=0):
     info = stock.info
-    last = df.iloc[-1]
     quote_type = info.get('quoteType', 'EQUITY')
-    
-    df['SMA200'] = df['Close'].rolling(200).mean()
-    sma_200 = df['SMA200'].iloc[-1] if not pd.isna(df['SMA200'].iloc[-1]) else last['Close']
-    
-    delta = df['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-    rsi = 100 - (100 / (1 + gain/loss)).iloc[-1]
-    rsi = rsi if not pd.isna(rsi) else 50
-    
-    df['SMA20'] = df['Close'].rolling(20).mean()
-    df['STD20'] = df['Close'].rolling(20).std()
-    bb_width = ((df['SMA20'] + 2*df['STD20']) - (df['SMA20'] - 2*df['STD20'])) / df['SMA20']
-    is_squeeze = bb_width.iloc[-1] < 0.05 
-    
-    max_dd = (df['Close'] / df['Close'].cummax() - 1).min() * 100
-    
-    vol_mean = df['Volume'].rolling(20).mean().iloc[-1]
-    vol_std = df['Volume'].rolling(20).std().iloc[-1]
-    z_score = (last['Volume'] - vol_mean) / vol_std if vol_std else 0
+    if ind is None: ind = compute_indicators(*frames_to_matrix([df]))
+    row = ind.summary[i]
 
     metrics = {
-        "QuoteType": quote_type, "Price": last['Close'],
-        "Trend": "UP 🐂" if last['Close'] > sma_200 else "DOWN 🐻",
-        "RSI": rsi, "Whale_Z": z_score, "Squeeze": is_squeeze, "MaxDD": max_dd,
+        "QuoteType": quote_type, "Price": float(row["Price"]),
+        "Trend": "UP 🐂" if row["Trend_Up"] else "DOWN 🐻",
+        "RSI": float(row["RSI"]), "Whale_Z": float(row["Whale_Z"]), "Squeeze": bool(row["Squeeze"]), "MaxDD": float(row["MaxDD"]),
         "Sector": info.get('sector', 'N/A')
     }
 
@@ -181,103 +1499,582 @@ def calculate_metrics(stock, df):
 
     return metrics
 
-def generate_pro_chart(df, ticker):
+# --- RENDU DES GRAPHIQUES (pool de processus + cache PNG) ---
+_CHART_STYLE = None
+
+def _chart_style():
+    # Construit une seule fois par worker
+    global _CHART_STYLE
+    if _CHART_STYLE is None:
+        _CHART_STYLE = mpf.make_mpf_style(marketcolors=mpf.make_marketcolors(up='#00ff00', down='#ff0000', edge='inherit', wick='inherit', volume='in'), base_mpf_style='nightclouds', gridstyle=':')
+    return _CHART_STYLE
+
+def _render_chart_png(plot_df, ticker):
     buf = io.BytesIO()
-    df['SMA50'] = df['Close'].rolling(50).mean()
-    df['SMA200'] = df['Close'].rolling(200).mean()
-    delta = df['Close'].diff()
-    df['RSI'] = 100 - (100 / (1 + (delta.where(delta > 0, 0)).rolling(14).mean() / (-delta.where(delta < 0, 0)).rolling(14).mean()))
-    
-    plot_df = df.tail(126) 
-    s = mpf.make_mpf_style(marketcolors=mpf.make_marketcolors(up='#00ff00', down='#ff0000', edge='inherit', wick='inherit', volume='in'), base_mpf_style='nightclouds', gridstyle=':')
-    
     apds = []
     if not plot_df['SMA50'].isna().all(): apds.append(mpf.make_addplot(plot_df['SMA50'], color='cyan', width=0.8, panel=0))
     if not plot_df['SMA200'].isna().all(): apds.append(mpf.make_addplot(plot_df['SMA200'], color='orange', width=0.8, panel=0))
     if not plot_df['RSI'].isna().all(): apds.append(mpf.make_addplot(plot_df['RSI'], panel=2, color='white', width=0.8, ylabel='RSI', ylim=(0,100)))
     
-    kwargs = dict(type='candle', style=s, title=f"\n{ticker} - Terminal", volume=True, panel_ratios=(6, 2, 2), savefig=dict(fname=buf, dpi=100, bbox_inches='tight'), figsize=(10, 6))
+    kwargs = dict(type='candle', style=_chart_style(), title=f"\n{ticker} - Terminal", volume=True, panel_ratios=(6, 2, 2), savefig=dict(fname=buf, dpi=100, bbox_inches='tight'), figsize=(10, 6))
     if apds: kwargs['addplot'] = apds
         
     mpf.plot(plot_df, **kwargs)
-    buf.seek(0)
-    return discord.File(buf, filename=f"{ticker}_chart.png")
+    return buf.getvalue()
+
+CHART_POOL = None
+CHART_SLOTS = threading.BoundedSemaphore(CHART_QUEUE_MAX)
+CHART_CACHE = OrderedDict()  # (ticker, date du dernier bar) -> PNG
+CHART_LOCK = threading.Lock()
+
+def chart_pool():
+    global CHART_POOL
+    with CHART_LOCK:
+        if CHART_POOL is None:
+            CHART_POOL = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=_chart_style)
+        return CHART_POOL
+
+def _chart_worker_ready(): return os.getpid()  # no-op : force le spawn du worker et son initializer (style mpf)
+
+def render_chart(fn, key, *args):
+    global CHART_POOL
+    with CHART_LOCK:
+        if key in CHART_CACHE:
+            CHART_CACHE.move_to_end(key)
+            return CHART_CACHE[key]
+    # Backpressure : file pleine -> pas de graphique plutôt que de bloquer le reste du bot
+    if not CHART_SLOTS.acquire(timeout=CHART_QUEUE_TIMEOUT):
+        TRACER.error("chart.render", TimeoutError("file de rendu pleine"))
+        return None
+    try:
+        with TRACER.span("chart.render"): png = chart_pool().submit(fn, *args).result()
+    except BrokenProcessPool:
+        with CHART_LOCK: CHART_POOL = None
+        return None
+    finally: CHART_SLOTS.release()
+    with CHART_LOCK:
+        CHART_CACHE[key] = png
+        while len(CHART_CACHE) > CHART_CACHE_SIZE: CHART_CACHE.popitem(last=False)
+    return png
+
+@traced("chart")
+def chart_png(df, ticker, ind=None, i=0):
+    if ind is None: ind = compute_indicators(*frames_to_matrix([df]))
+    n = min(126, len(df))
+    # Copie : le DataFrame de l'appelant (souvent partagé via le cache) n'est jamais modifié
+    plot_df = df.tail(n)[['Open', 'High', 'Low', 'Close', 'Volume']].copy()
+    plot_df['SMA50'], plot_df['SMA200'], plot_df['RSI'] = ind.sma50[i, -n:], ind.sma200[i, -n:], ind.rsi[i, -n:]
+    return render_chart(_render_chart_png, ("terminal", ticker, str(df.index[-1].date())), plot_df, ticker)
 
 # --- COMMANDES ---
+def parse_tickers(args):
+    # "!add AAPL MSFT" ou "!add AAPL,MSFT" -> (symboles normalisés (alias, crypto "-USD"), inconnus tels que tapés).
+    # Pas de correction floue ici ; annuaire pas encore chargé -> tout est accepté tel quel.
+    tickers, unknown = [], []
+    for t in dict.fromkeys(t.strip().upper() for a in args for t in a.split(",") if t.strip()):
+        r = RESOLVER.resolve(t)
+        if r and r.match != "fuzzy": tickers.append(r.symbol)
+        else: unknown.append(t)
+    return list(dict.fromkeys(tickers)), unknown
+
+def unknown_line(unknown):
+    hints = [f"`{t}` (→ {', '.join(RESOLVER.suggest(t)) or '?'})" for t in unknown[:10]]
+    return f"❓ Symbole{'s' if len(unknown) > 1 else ''} inconnu{'s' if len(unknown) > 1 else ''} ignoré{'s' if len(unknown) > 1 else ''} : " + ", ".join(hints)
+
 @bot.command(name="add")
-async def add_to_watchlist(ctx, ticker: str):
-    ticker = ticker.upper()
-    if ticker in COMMON_TYPOS: ticker = COMMON_TYPOS[ticker]
-    w = load_watchlist()
-    if ticker not in w: w.append(ticker); save_watchlist(w); await ctx.send(f"✅ **{ticker}** ajouté.")
-    else: await ctx.send(f"⚠️ **{ticker}** déjà présent.")
+async def add_to_watchlist(ctx, *args: str):
+    tickers, unknown = parse_tickers(args)
+    if not tickers and not unknown: return await discord_call("send", ctx.send("⚠️ Usage : `!add AAPL MSFT ...`"), ctx.channel)
+    # Un symbole inconnu de l'annuaire n'entre pas : chaque scan et chaque poll intraday le téléchargeraient pour rien
+    added, present = WATCHLISTS.add(watchlist_scope(ctx.channel), tickers) if tickers else ([], [])
+    lines = [unknown_line(unknown)] if unknown else []
+    if added: lines.append(f"✅ **{', '.join(added)}** ajouté{'s' if len(added) > 1 else ''}.")
+    if present: lines.append(f"⚠️ **{', '.join(present)}** déjà présent{'s' if len(present) > 1 else ''}.")
+    await discord_call("send", ctx.send("\n".join(lines)), ctx.channel)
 
 @bot.command(name="remove")
-async def remove_from_watchlist(ctx, ticker: str):
-    ticker = ticker.upper()
-    if ticker in COMMON_TYPOS: ticker = COMMON_TYPOS[ticker]
-    w = load_watchlist()
-    if ticker in w: w.remove(ticker); save_watchlist(w); await ctx.send(f"🗑️ **{ticker}** retiré.")
+async def remove_from_watchlist(ctx, *args: str):
+    tickers, unknown = parse_tickers(args)
+    tickers += unknown  # retrait tel que tapé : permet de nettoyer un symbole ajouté avant la vérification
+    if not tickers: return await discord_call("send", ctx.send("⚠️ Usage : `!remove AAPL MSFT ...`"), ctx.channel)
+    removed, missing = WATCHLISTS.remove(watchlist_scope(ctx.channel), tickers)
+    lines = []
+    if removed: lines.append(f"🗑️ **{', '.join(removed)}** retiré{'s' if len(removed) > 1 else ''}.")
+    if missing: lines.append(f"❔ **{', '.join(missing)}** absent{'s' if len(missing) > 1 else ''} de la watchlist.")
+    await discord_call("send", ctx.send("\n".join(lines)), ctx.channel)
 
 @bot.command(name="list")
 async def show_watchlist(ctx):
-    await ctx.send(f"📋 **Watchlist :** " + ", ".join(load_watchlist()))
+    await discord_call("send", ctx.send(f"📋 **Watchlist :** " + ", ".join(WATCHLISTS.get(watchlist_scope(ctx.channel)))), ctx.channel)
+
+@bot.command(name="cache")
+async def show_cache(ctx):
+    s, l = MARKET_CACHE.summary(), LLM.summary()
+    await discord_call("send", ctx.send(f"🗄️ **Cache Marché :** {s['hits']} hits | {s['misses']} miss | {s['coalesced']} fusionnés | Hit rate {s['hit_rate']:.1f}%\n"
+                                        f"`{s['entries']}` entrées | {s['mb']:.1f}/{CACHE_MAX_MB:.0f} MB | {s['evictions']} évictions\n"
+                                        f"🧠 **LLM :** {l['calls']} appels | {l['cache_hits']} mémos en cache | {l['errors']} erreurs | p50 {l['p50']:.1f}s p95 {l['p95']:.1f}s | "
+                                        f"{l['prompt_tokens']} tokens in / {l['output_tokens']} out"), ctx.channel)
+
+@bot.command(name="stats")
+async def show_stats(ctx, prefix: str = ""):
+    # !stats [préfixe] -> latences p50/p95/p99 (ms) et erreurs par étape, ex: !stats data
+    rows = [(n, s) for n, s in TRACER.summary().items() if n.startswith(prefix)]
+    if not rows: return await discord_call("send", ctx.send("📊 Aucune mesure pour l'instant."), ctx.channel)
+    lines = [f"{'ÉTAPE':<22}{'N':>6}{'p50':>8}{'p95':>8}{'p99':>8}  ERREURS"]
+    for n, s in rows:
+        lines.append(f"{n[:22]:<22}{s['calls']:>6}{s['p50'] * 1000:>8.0f}{s['p95'] * 1000:>8.0f}{s['p99'] * 1000:>8.0f}  {s['errors']} ({s['error_rate']:.1f}%)")
+    report = "\n".join(lines)
+    errors = [f"⚠️ `{n}` : {s['last_error']}" for n, s in rows if s["last_error"]]
+    chunks = [report[i:i + 1900] for i in range(0, len(report), 1900)]
+    for chunk in chunks: await discord_call("send", ctx.send(f"📊 **Latences (ms, {TRACE_WINDOW} derniers appels)**\n```\n{chunk}```" if chunk is chunks[0] else f"```\n{chunk}```"), ctx.channel)
+    if errors: await discord_call("send", ctx.send("\n".join(errors[:10])[:1900]), ctx.channel)
+
+@bot.command(name="screen")
+async def screen(ctx, universe: str = "", top: int = 0):
+    # !screen [sp500|russell1000|<liste locale>] [N]
+    universe, top = universe or SCREEN_UNIVERSE, top or SCREEN_TOP_N
+    if SCREEN_LOCK.locked(): return await discord_call("send", ctx.send("⏳ Un screen est déjà en cours."), ctx.channel)
+    status = await discord_call("send", ctx.send(f"🌐 **Screener {universe.upper()}...**"), ctx.channel)
+    res = await run_screen(universe, max(1, min(top, 25)))
+    if not res: return await discord_call("edit", status.edit(content=f"❌ Univers `{universe}` introuvable."), ctx.channel)
+    await deliver(ctx.channel, status, [screen_embed(universe, res)])
+
+@bot.command(name="compare")
+async def compare(ctx, *args: str):
+    # !compare AAPL MSFT NVDA ... -> un seul terminal comparatif
+    tickers, unknown = [], []
+    for t in dict.fromkeys(t.strip().upper() for a in args for t in a.split(",") if t.strip()):
+        res = RESOLVER.resolve(t)
+        if res and res.match != "fuzzy": tickers.append(res.symbol)
+        else: unknown.append(t)
+    tickers = list(dict.fromkeys(tickers))[:COMPARE_MAX]
+    if len(tickers) < 2: return await discord_call("send", ctx.send(f"⚠️ Usage : `!compare AAPL MSFT NVDA` (2 à {COMPARE_MAX} symboles connus)." + (f" Inconnus : {', '.join(unknown)}" if unknown else "")), ctx.channel)
+
+    status = await discord_call("send", ctx.send(f"⚖️ **Comparatif : {', '.join(tickers)}...**"), ctx.channel)
+    try:
+        payload = await build_compare(tickers)
+        if not payload: return await discord_call("edit", status.edit(content="❌ Pas assez de données pour comparer."), ctx.channel)
+        MEMORY.remember(ctx.channel.id, payload["memory"], "compare")
+
+        await deliver(ctx.channel, status, [payload["embed"], payload["embed_memo"]], payload["chart"], "compare_chart.png")
+    except Exception as e:
+        await discord_call("edit", status.edit(content="❌ Crash interne de génération."), ctx.channel)
+        print(f"ERROR compare: {e}", flush=True)
+
+@bot.command(name="risk")
+async def risk(ctx):
+    # !risk -> volatilité, VaR, corrélations et clusters de la watchlist du serveur
+    scope = watchlist_scope(ctx.channel)
+    res = await asyncio.to_thread(portfolio_risk, scope, WATCHLISTS.get(scope))
+    if not res: return await discord_call("send", ctx.send("❌ Pas assez d'historique (2 actifs minimum)."), ctx.channel)
+    await discord_call("send", ctx.send(embed=risk_embed(res)), ctx.channel)
+
+REPORT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Stock analysis pdf generator.py")
+REPORT_TIMEOUT = float(os.getenv("REPORT_TIMEOUT", 900))
+REPORT_LOCK = asyncio.Lock()
+
+@bot.command(name="report")
+async def report(ctx, *args: str):
+    # !report [split] [TICKER ...] -> rapports PDF (watchlist du serveur par défaut), générés par le script PDF en mode batch.
+    # Sous-processus : pool de rendu, Mistral et fpdf restent hors du process du bot.
+    split = bool(args) and args[0].lower() == "split"
+    tickers, unknown = parse_tickers(args[1:] if split else args)
+    if unknown and not tickers: return await discord_call("send", ctx.send(unknown_line(unknown)), ctx.channel)
+    tickers = tickers or WATCHLISTS.get(watchlist_scope(ctx.channel))
+    if REPORT_LOCK.locked(): return await discord_call("send", ctx.send("⏳ Une génération de rapports est déjà en cours."), ctx.channel)
+    async with REPORT_LOCK:
+        status = await discord_call("send", ctx.send(f"📄 **Rapports PDF : {len(tickers)} actifs...**"), ctx.channel)
+        out_dir = tempfile.mkdtemp(prefix="reports_")
+        try:
+            with TRACER.span("report.batch"):
+                proc = await asyncio.create_subprocess_exec(sys.executable, REPORT_SCRIPT, *tickers, "--out", out_dir, *([] if split else ["--combined"]),
+                                                            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+                try: output, _ = await asyncio.wait_for(proc.communicate(), REPORT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    return await discord_call("edit", status.edit(content="❌ Génération des rapports trop longue, abandon."), ctx.channel)
+            files = sorted(glob.glob(os.path.join(out_dir, "*.pdf")))
+            if proc.returncode != 0 or not files:
+                print(output.decode(errors="replace")[-2000:], flush=True)
+                return await discord_call("edit", status.edit(content="❌ Échec de la génération des rapports."), ctx.channel)
+            await discord_call("delete", status.delete(), ctx.channel)
+            for i in range(0, len(files), 10):  # 10 pièces jointes max par message Discord
+                await discord_call("send", ctx.send(files=[discord.File(f) for f in files[i:i + 10]]), ctx.channel)
+        finally: shutil.rmtree(out_dir, ignore_errors=True)
+
+@bot.command(name="backtest")
+async def backtest(ctx, universe: str = "watchlist", years: int = 5, horizon: int = 20):
+    # !backtest [watchlist|sp500|russell1000|<liste>] [années] [horizon 5|20|60]
+    if horizon not in BACKTEST_HORIZONS: return await discord_call("send", ctx.send(f"⚠️ Horizon possible : {', '.join(map(str, BACKTEST_HORIZONS))} jours."), ctx.channel)
+    period = "1y" if years <= 1 else "2y" if years <= 2 else "5y" if years <= 5 else "10y"
+    if universe.lower() == "watchlist": symbols = WATCHLISTS.get(watchlist_scope(ctx.channel))
+    else: symbols = await asyncio.to_thread(load_universe, universe)
+    if not symbols: return await discord_call("send", ctx.send(f"❌ Univers `{universe}` introuvable."), ctx.channel)
+    status = await discord_call("send", ctx.send(f"🧪 **Backtest {universe.upper()} : {len(symbols)} symboles, {period}...**"), ctx.channel)
+    res = await asyncio.to_thread(run_backtest, symbols, period)
+    if not res: return await discord_call("edit", status.edit(content="❌ Pas assez d'historique pour backtester."), ctx.channel)
+    await deliver(ctx.channel, status, [backtest_embed(universe, res, horizon)])
 
 @bot.command(name="forcescan")
 async def force_scan(ctx):
-    await ctx.send("🛠️ **Scanner d'Anomalies...**")
-    await daily_scanner()
+    # Manuel : toutes les anomalies en cours sont postées, même celles déjà signalées
+    await discord_call("send", ctx.send("🛠️ **Scanner d'Anomalies...**"), ctx.channel)
+    await daily_scanner(force=True)
 
 # --- SCANNER AUTONOME ---
+SCAN_POOL = ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="scan")
+ALERT_DB = os.path.join(DATA_DIR, "alerts.db")
+ALERT_REPEAT_DAYS = float(os.getenv("ALERT_REPEAT_DAYS", 7))  # rappel d'une anomalie toujours active (0 = jamais)
+Alert = namedtuple("Alert", "ticker price reasons")  # reasons : {règle: texte}, vide si rien à signaler
+
+def alert_line(alert, rules=None):
+    reasons = [v for k, v in alert.reasons.items() if rules is None or k in rules]
+    return f"**{alert.ticker}** (${alert.price:.2f}) ➔ " + " | ".join(reasons)
+
+class AlertState:
+    # Règles actives par (source, symbole), persistées : une anomalie inchangée n'est pas repostée à chaque scan ni après un redémarrage.
+    # Une règle qui disparaît est oubliée -> elle sera de nouveau signalée si elle revient.
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS alerts (source TEXT NOT NULL, ticker TEXT NOT NULL, rule TEXT NOT NULL, "
+                        "posted REAL NOT NULL, PRIMARY KEY (source, ticker, rule))")
+        self.lock = threading.Lock()
+
+    def pending(self, source, alerts, force=False):
+        # alerts : un Alert par symbole effectivement scanné -> {symbole: règles nouvelles (ou à rappeler)} ; rien n'est écrit ici
+        cutoff = time.time() - ALERT_REPEAT_DAYS * 86400 if ALERT_REPEAT_DAYS > 0 else -1.0
+        with self.lock:
+            posted = {}
+            for t, r, ts in self.db.execute("SELECT ticker, rule, posted FROM alerts WHERE source = ?", (source,)): posted.setdefault(t, {})[r] = ts
+        fresh = {}
+        for a in alerts:
+            known = posted.get(a.ticker, {})
+            new = {r for r in a.reasons if force or r not in known or known[r] < cutoff}
+            if new: fresh[a.ticker] = new
+        return fresh
+
+    def commit(self, source, alerts, fresh):
+        # Appelé seulement une fois l'envoi Discord réussi : un envoi raté laisse les alertes "à poster" au prochain scan
+        now = time.time()
+        with self.lock, self.db:
+            for a in alerts:
+                known = [r for (r,) in self.db.execute("SELECT rule FROM alerts WHERE source = ? AND ticker = ?", (source, a.ticker))]
+                self.db.executemany("DELETE FROM alerts WHERE source = ? AND ticker = ? AND rule = ?", [(source, a.ticker, r) for r in known if r not in a.reasons])
+                self.db.executemany("INSERT OR REPLACE INTO alerts VALUES (?, ?, ?, ?)", [(source, a.ticker, r, now) for r in fresh.get(a.ticker, ())])
+
+    def last_report(self, source, key):
+        # Rapports entiers (screener d'univers) : une ligne (source, univers, "report") -> horodatage du dernier envoi
+        with self.lock: row = self.db.execute("SELECT posted FROM alerts WHERE source = ? AND ticker = ? AND rule = 'report'", (source, key)).fetchone()
+        return row[0] if row else 0.0
+
+    def mark_report(self, source, key, ts):
+        with self.lock, self.db: self.db.execute("INSERT OR REPLACE INTO alerts VALUES (?, ?, 'report', ?)", (source, key, ts))
+
+ALERT_STATE = AlertState(ALERT_DB)
+
+def scan_rules(metrics, insider, earnings, options=OPTIONS_EMPTY):
+    # {règle: texte} -> l'ordre d'insertion donne l'ordre du rapport, la clé sert à la déduplication
+    reasons = {}
+    if metrics["Whale_Z"] > 2.5: reasons["whale"] = f"🐳 Whale Vol (Z: {metrics['Whale_Z']:.1f})"
+    if metrics["RSI"] < 30: reasons["oversold"] = f"📉 Oversold (RSI: {metrics['RSI']:.1f})"
+    if metrics["Squeeze"]: reasons["squeeze"] = "🗜️ VOL SQUEEZE (Breakout Risk)"
+    if "BUYING" in insider: reasons["insider"] = "🟢 Insider Buying"
+    if options.unusual:
+        u = options.unusual[0]
+        reasons["options"] = f"{'🎯 Unusual Calls' if u.side == 'C' else '🛡️ Unusual Puts'} ({unusual_label(u)})"
+
+    if earnings != "N/A":
+        try:
+            days = (datetime.datetime.strptime(earnings, "%Y-%m-%d").date() - market_today()).days
+            if 0 <= days <= 7: reasons["earnings"] = f"⚠️ Earnings in {days}d"
+        except ValueError: pass
+    return reasons
+
+@traced("scanner.ticker")
+def scan_ticker(ticker, df, ind=None, i=0):
+    stock = CachedTicker(ticker)
+    metrics = calculate_metrics(stock, df, ind, i)
+    insider, options, earnings = get_smart_money_data(stock, metrics["QuoteType"])
+    return Alert(ticker, metrics['Price'], scan_rules(metrics, insider, earnings, options))
+
+async def run_scanner(watchlist):
+    # Un Alert par symbole scanné avec succès (reasons vide = rien à signaler) : AlertState a besoin des deux
+    try:
+        with TRACER.span("scanner.download"): frames = await asyncio.to_thread(batch_history, watchlist)
+    except Exception as e:
+        print(f"Erreur Scanner download: {e}", flush=True)
+        return []
+    tickers = [t for t in watchlist if t in frames]
+    ind = await asyncio.to_thread(lambda: compute_indicators(*frames_to_matrix([frames[t] for t in tickers])))
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(SCAN_CONCURRENCY)
+
+    async def worker(i, ticker):
+        await sem.acquire()
+        fut = loop.run_in_executor(SCAN_POOL, scan_ticker, ticker, frames[ticker], ind, i)
+        def release(f):
+            # Le slot n'est rendu qu'à la fin réelle du thread (même après un timeout)
+            sem.release()
+            if not f.cancelled(): f.exception()
+        fut.add_done_callback(release)
+        try: return await asyncio.wait_for(asyncio.shield(fut), SCAN_TICKER_TIMEOUT)
+        except asyncio.TimeoutError as e:
+            TRACER.error("scanner.ticker", e)
+            print(f"Scan timeout: {ticker}", flush=True)
+        except Exception: return None  # déjà compté par @traced("scanner.ticker")
+
+    results = await asyncio.gather(*(worker(i, t) for i, t in enumerate(tickers)))
+    return [r for r in results if r]
+
 @tasks.loop(hours=24)
-async def daily_scanner():
+@traced("scanner.daily")
+async def daily_scanner(force=False):
     if ALERT_CHANNEL_ID == 0: return
     channel = bot.get_channel(ALERT_CHANNEL_ID)
     if not channel: return
 
-    watchlist = load_watchlist()
-    anomalies = []
-
-    def scan():
-        for ticker in watchlist:
-            try:
-                stock = yf.Ticker(ticker)
-                df = stock.history(period="1y")
-                if df.empty: continue
-                metrics = calculate_metrics(stock, df)
-                insider, _, earnings = get_smart_money_data(stock, metrics["QuoteType"])
-                
-                reasons = []
-                if metrics["Whale_Z"] > 2.5: reasons.append(f"🐳 Whale Vol (Z: {metrics['Whale_Z']:.1f})")
-                if metrics["RSI"] < 30: reasons.append(f"📉 Oversold (RSI: {metrics['RSI']:.1f})")
-                if metrics["Squeeze"]: reasons.append("🗜️ VOL SQUEEZE (Breakout Risk)")
-                if "BUYING" in insider: reasons.append("🟢 Insider Buying")
-                
-                if earnings != "N/A":
-                    try:
-                        days = (datetime.datetime.strptime(earnings, "%Y-%m-%d").date() - datetime.date.today()).days
-                        if 0 <= days <= 7: reasons.append(f"⚠️ Earnings in {days}d")
-                    except: pass
-                    
-                if reasons: anomalies.append(f"**{ticker}** (${metrics['Price']:.2f}) ➔ " + " | ".join(reasons))
-            except: continue
-
-    await asyncio.to_thread(scan)
+    results = await run_scanner(WATCHLISTS.get(watchlist_scope(channel)))
+    anomalies = [a for a in results if a.reasons]
+    fresh = ALERT_STATE.pending("daily", results, force)
     
-    if anomalies:
-        report = "\n".join(anomalies)
-        embed = discord.Embed(title="🚨 Institutional Radar", description=report, color=0xFFD700)
-        await channel.send(embed=embed)
-        if ALERT_CHANNEL_ID not in CHAT_HISTORY: CHAT_HISTORY[ALERT_CHANNEL_ID] = deque(maxlen=5)
-        CHAT_HISTORY[ALERT_CHANNEL_ID].append(f"[SCANNER]: {report}")
+    if fresh:
+        # Un symbole revient dès qu'une de ses règles est nouvelle ; les anomalies inchangées ne sont pas répétées
+        skipped = len(anomalies) - len(fresh)
+        embeds = paginate("🚨 Institutional Radar", [alert_line(a) for a in anomalies if a.ticker in fresh], 0xFFD700,
+                          f"{skipped} anomalie(s) inchangée(s) non répétée(s)" if skipped else None)
+        try: await send_embeds(channel, embeds)
+        except discord.HTTPException as e:
+            print(f"Erreur envoi Radar: {e}", flush=True)
+            return
+    ALERT_STATE.commit("daily", results, fresh)
+    if anomalies: MEMORY.remember_alerts(ALERT_CHANNEL_ID, [alert_line(a) for a in anomalies], "scanner")
 
 @daily_scanner.before_loop
 async def before_daily_scanner():
     await bot.wait_until_ready()
 
+# --- SCANNER INTRADAY (streaming) ---
+INTRADAY_INTERVAL_MIN = float(os.getenv("INTRADAY_INTERVAL_MIN", 5))
+INTRADAY_BAR = os.getenv("INTRADAY_BAR", "5m")
+INTRADAY_STATE_FILE = os.path.join(DATA_DIR, "intraday_streams.json")
+INTRADAY = {"streams": None}
+MARKET_TZ = zoneinfo.ZoneInfo("America/New_York")
+MARKET_HOURS = (datetime.time(9, 30), datetime.time(16, 0))
+
+def market_open(now=None):
+    # Séance US régulière (lun-ven, 9h30-16h New York) ; les jours fériés ne sont pas gérés (le poll ne voit alors aucune barre nouvelle)
+    now = now or datetime.datetime.now(MARKET_TZ)
+    return now.weekday() < 5 and MARKET_HOURS[0] <= now.time() < MARKET_HOURS[1]
+
+def intraday_events(ticker):
+    # Insider / earnings ne bougent pas en séance : SMART_MONEY les garde selon leur propre TTL (jamais de chaîne d'options ici)
+    try:
+        stock = CachedTicker(ticker)
+        insider, _, earnings = get_smart_money_data(stock, stock.info.get('quoteType', 'EQUITY'), ("insider", "earnings"))
+    except Exception: insider, earnings = SMART_MONEY_DEFAULTS["insider"], SMART_MONEY_DEFAULTS["earnings"]
+    return insider, earnings
+
+@traced("scanner.intraday")
+def intraday_poll(watchlist):
+    streams = INTRADAY["streams"]
+    if streams is None: streams = INTRADAY["streams"] = load_streams(INTRADAY_STATE_FILE)
+    for t in list(streams):
+        if t not in watchlist: del streams[t]
+
+    # Premier poll d'une séance (ou symbole nouveau) : reseed depuis l'historique journalier, dont la dernière barre de la veille
+    # est la barre définitive (clôture + volume d'enchère), et non le dernier poll avant 16h ; sinon Whale_Z/SMA/RSI dérivent
+    today = str(market_today())
+    to_seed = [t for t in watchlist if t not in streams or streams[t].date != today]
+    for t, df in batch_history(to_seed).items(): streams[t] = SymbolStream.seed(df)
+
+    if not streams: return [], {}
+    for t, df in PROVIDER.download(list(streams), period="1d", interval=INTRADAY_BAR).items():
+        streams[t].update(float(df['Close'].iloc[-1]), float(df['Volume'].sum()), str(df.index[-1].date()))
+    events = dict(zip(streams, SCAN_POOL.map(intraday_events, list(streams))))
+
+    # Seules les règles nouvellement déclenchées sont annoncées (état persistant : un redémarrage ne les rejoue pas)
+    results = []
+    for t in watchlist:
+        if t not in streams: continue
+        snap = streams[t].snapshot()
+        results.append(Alert(t, snap['Price'], scan_rules(snap, *events[t])))
+    save_streams(streams, INTRADAY_STATE_FILE)
+    return results, ALERT_STATE.pending("intraday", results)
+
+@tasks.loop(minutes=INTRADAY_INTERVAL_MIN)
+async def intraday_scanner():
+    if ALERT_CHANNEL_ID == 0 or not market_open(): return
+    channel = bot.get_channel(ALERT_CHANNEL_ID)
+    if not channel: return
+
+    try: results, fresh = await asyncio.to_thread(intraday_poll, WATCHLISTS.get(watchlist_scope(channel)))
+    except Exception as e:
+        print(f"Erreur Scanner Intraday: {e}", flush=True)
+        return
+
+    alerts = [alert_line(a, fresh[a.ticker]) for a in results if a.ticker in fresh]
+    if alerts:
+        try: await send_embeds(channel, paginate("⚡ Intraday Radar", alerts, 0xFF8C00))
+        except discord.HTTPException as e:
+            print(f"Erreur envoi Radar Intraday: {e}", flush=True)
+            return
+        MEMORY.remember_alerts(ALERT_CHANNEL_ID, alerts, "scanner intraday")
+    ALERT_STATE.commit("intraday", results, fresh)
+
+@intraday_scanner.before_loop
+async def before_intraday_scanner():
+    await bot.wait_until_ready()
+
+# --- SCREENER D'UNIVERS (S&P 500, Russell 1000, listes locales) ---
+SCREEN_UNIVERSE = os.getenv("SCREEN_UNIVERSE", "sp500")
+SCREEN_CHUNK = int(os.getenv("SCREEN_CHUNK", 200))
+SCREEN_WORKERS = int(os.getenv("SCREEN_WORKERS", 2))
+SCREEN_TOP_N = int(os.getenv("SCREEN_TOP_N", 10))
+SCREEN_INTERVAL_H = float(os.getenv("SCREEN_INTERVAL_H", 24))
+UNIVERSE_DIR = os.path.join(DATA_DIR, "universes")
+UNIVERSE_REFRESH_DAYS = 7
+UNIVERSE_SOURCES = {
+    "sp500": "https://raw.githubusercontent.com/datasets/s-and-p-500-companies/main/data/constituents.csv",
+    "russell1000": "https://www.ishares.com/us/products/239707/ishares-russell-1000-etf/1467271812596.ajax?fileType=csv&fileName=IWB_holdings&dataType=fund",
+}
+SCREEN_LOCK = asyncio.Lock()
+
+def _parse_universe(text):
+    # CSV avec une colonne Symbol/Ticker (lignes de métadonnées avant l'en-tête tolérées, cf. iShares) ou un symbole par ligne
+    lines = [l for l in text.splitlines() if l.strip() and not l.startswith("#")]
+    head = next((i for i, l in enumerate(lines) if re.match(r'^"?(Symbol|Ticker)"?\s*(,|$)', l, re.I)), None)
+    if head is None: symbols = [l.split(",")[0] for l in lines]
+    else:
+        df = pd.read_csv(io.StringIO("\n".join(lines[head:])), on_bad_lines="skip", dtype=str)
+        if "Asset Class" in df.columns: df = df[df["Asset Class"] == "Equity"]
+        symbols = df[df.columns[0]].dropna().tolist()
+    symbols = (s.strip().strip('"').upper().replace(".", "-").replace(" ", "-") for s in symbols)
+    return list(dict.fromkeys(s for s in symbols if re.match(r'^[A-Z0-9^][A-Z0-9^-]{0,9}$', s)))
+
+def load_universe(name):
+    # Univers connu -> téléchargé puis gardé UNIVERSE_REFRESH_DAYS jours dans data/universes ; sinon liste locale data/universes/<nom>.txt|csv
+    # Le nom vient de Discord : seul [a-z0-9_-] est accepté, jamais un chemin (pas de !screen /etc/passwd ni ../../.env)
+    key = name.lower()
+    if not re.fullmatch(r"[a-z0-9_-]+", key): return []
+    path = os.path.join(UNIVERSE_DIR, f"{key}.txt")
+    if key not in UNIVERSE_SOURCES:
+        for p in (path, os.path.join(UNIVERSE_DIR, f"{key}.csv")):
+            if os.path.isfile(p):
+                with open(p) as f: return _parse_universe(f.read())
+        return []
+    if not os.path.exists(path) or time.time() - os.path.getmtime(path) > UNIVERSE_REFRESH_DAYS * 86400:
+        try:
+            req = urllib.request.Request(UNIVERSE_SOURCES[key], headers={"User-Agent": "Mozilla/5.0"})
+            with urllib.request.urlopen(req, timeout=30) as r: symbols = _parse_universe(r.read().decode("utf-8-sig", "replace"))
+            if symbols:
+                os.makedirs(UNIVERSE_DIR, exist_ok=True)
+                with open(path, "w") as f: f.write("\n".join(symbols))
+                return symbols
+        except Exception as e: TRACER.error("screen.universe", e)
+    if not os.path.exists(path): return []
+    with open(path) as f: return _parse_universe(f.read())
+
+@traced("screen.chunk")
+def screen_chunk(symbols):
+    # Download groupé -> indicateurs vectorisés -> seule la ligne de synthèse survit : les DataFrames du chunk sont libérés au retour
+    frames = OHLCV_STORE.batch(symbols, "1y")
+    tickers = [t for t in symbols if t in frames and len(frames[t]) >= 30]
+    return tickers, compute_indicators(*frames_to_matrix([frames[t] for t in tickers])).summary
+
+def _rank(values, n, descending=False):
+    v = np.where(np.isnan(values), np.inf, -values if descending else values)
+    return [int(i) for i in np.argsort(v, kind="stable")[:n] if np.isfinite(v[i])]
+
+def _screen_events(ticker):
+    try:
+        stock = CachedTicker(ticker)
+        return get_smart_money_data(stock, stock.info.get('quoteType', 'EQUITY'))
+    except Exception: return SMART_MONEY_DEFAULTS["insider"], OPTIONS_EMPTY, SMART_MONEY_DEFAULTS["earnings"]
+
+@traced("screen.total")
+async def screen_universe(symbols, top_n=SCREEN_TOP_N):
+    # Chunks de SCREEN_CHUNK symboles, au plus SCREEN_WORKERS en vol : la mémoire ne dépend pas de la taille de l'univers
+    t0 = time.perf_counter()
+    sem = asyncio.Semaphore(SCREEN_WORKERS)
+
+    async def run(chunk):
+        async with sem:
+            try: return await asyncio.to_thread(screen_chunk, chunk)
+            except Exception: return [], np.zeros(0, dtype=SUMMARY_DTYPE)  # déjà compté par @traced("screen.chunk")
+
+    parts = await asyncio.gather(*(run(symbols[i:i + SCREEN_CHUNK]) for i in range(0, len(symbols), SCREEN_CHUNK)))
+    tickers = [t for p in parts for t in p[0]]
+    summary = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=SUMMARY_DTYPE)
+
+    # Règles du scanner sur tout l'univers (techniques) ; insiders / options / earnings seulement pour les anomalies affichées
+    flagged = []
+    for i, t in enumerate(tickers):
+        metrics = {k: summary[k][i] for k in ("Price", "RSI", "Whale_Z", "Squeeze")}
+        reasons = scan_rules(metrics, SMART_MONEY_DEFAULTS["insider"], SMART_MONEY_DEFAULTS["earnings"])
+        if reasons: flagged.append((len(reasons), np.nan_to_num(metrics["Whale_Z"], nan=-np.inf), i))
+    flagged.sort(reverse=True)
+    top = [i for _, _, i in flagged[:top_n]]
+    loop = asyncio.get_running_loop()
+    events = await asyncio.gather(*(loop.run_in_executor(SCAN_POOL, _screen_events, tickers[i]) for i in top))
+    anomalies = []
+    for i, (insider, options, earnings) in zip(top, events):
+        metrics = {k: summary[k][i] for k in ("Price", "RSI", "Whale_Z", "Squeeze")}
+        anomalies.append(f"**{tickers[i]}** (${metrics['Price']:.2f}) ➔ " + " | ".join(scan_rules(metrics, insider, earnings, options).values()))
+
+    return {
+        "universe": len(symbols), "analysed": len(tickers), "flagged": len(flagged), "anomalies": anomalies,
+        "whale": [(tickers[i], summary["Whale_Z"][i]) for i in _rank(summary["Whale_Z"], top_n, descending=True)],
+        "oversold": [(tickers[i], summary["RSI"][i]) for i in _rank(summary["RSI"], top_n)],
+        "tight": [(tickers[i], summary["BB_Width"][i]) for i in _rank(summary["BB_Width"], top_n)],
+        "elapsed": time.perf_counter() - t0,
+    }
+
+def screen_embed(name, res):
+    embed = discord.Embed(title=f"🌐 Universe Screener | {name.upper()}", color=0x00B3A4,
+                          description=f"{res['analysed']}/{res['universe']} symboles analysés en {res['elapsed']:.0f}s | {res['flagged']} anomalies")
+    def col(rows, fmt): return "\n".join(f"`{t:<6}` {fmt(v)}" for t, v in rows)[:1024] or "N/A"
+    embed.add_field(name="🐳 Whale Z", value=col(res["whale"], lambda v: f"{v:.1f}"), inline=True)
+    embed.add_field(name="📉 RSI Min", value=col(res["oversold"], lambda v: f"{v:.1f}"), inline=True)
+    embed.add_field(name="🗜️ BB Width", value=col(res["tight"], lambda v: f"{v * 100:.1f}%"), inline=True)
+    if res["anomalies"]: embed.add_field(name="🚨 Anomalies", value=clip_lines(res["anomalies"], EMBED_FIELD_MAX), inline=False)
+    return embed
+
+async def run_screen(name, top_n=SCREEN_TOP_N):
+    # Un seul screen à la fois : un univers de plusieurs milliers de symboles occupe déjà le fournisseur
+    async with SCREEN_LOCK:
+        symbols = await asyncio.to_thread(load_universe, name)
+        if not symbols: return None
+        return await screen_universe(symbols, top_n)
+
+@tasks.loop(hours=SCREEN_INTERVAL_H)
+async def universe_scanner():
+    if ALERT_CHANNEL_ID == 0 or not SCREEN_UNIVERSE: return
+    channel = bot.get_channel(ALERT_CHANNEL_ID)
+    if not channel: return
+    # tasks.loop tire dès le démarrage : un redémarrage (restart: unless-stopped) ne retélécharge ni ne reposte un rapport
+    # envoyé il y a moins de SCREEN_INTERVAL_H (marge de 10 min pour la dérive de la boucle)
+    started = time.time()
+    if started - ALERT_STATE.last_report("screen", SCREEN_UNIVERSE) < SCREEN_INTERVAL_H * 3600 - 600: return
+
+    res = await run_screen(SCREEN_UNIVERSE)
+    if not res: return
+    try: await discord_call("send", channel.send(embed=screen_embed(SCREEN_UNIVERSE, res)), channel)
+    except discord.HTTPException as e:
+        print(f"Erreur envoi Screener: {e}", flush=True)
+        return
+    ALERT_STATE.mark_report("screen", SCREEN_UNIVERSE, started)
+    if res["anomalies"]: MEMORY.remember_alerts(ALERT_CHANNEL_ID, res["anomalies"], f"screener {SCREEN_UNIVERSE}")
+
+@universe_scanner.before_loop
+async def before_universe_scanner():
+    await bot.wait_until_ready()
+
 # --- CHATBOT GEMINI ---
+@traced("chat")
 async def handle_conversation(message):
-    history = CHAT_HISTORY.get(message.channel.id, [])
+    history = MEMORY.recall(message.channel.id, message.content)
     context = "Aucune data." if not history else "\n".join(history)
     
     async with message.channel.typing():
@@ -291,127 +2088,511 @@ async def handle_conversation(message):
         3. LONG OU CASH SEULEMENT. INTERDICTION STRICTE DE PROPOSER DU SHORT, DES PUTS, OU DE LA VENTE A DECOUVERT. Si la situation est mauvaise, dis "RESTER EN CASH" ou "EVITER".
         """
         try:
-            response = await asyncio.to_thread(gemini_client.models.generate_content, model='gemini-2.5-flash', contents=prompt)
-            reply_text = response.text
+            reply_text = await LLM.generate(prompt)
             if len(reply_text) > 800: reply_text = reply_text[:800] + "...\n*(Réponse tronquée pour concision)*"
-            await message.reply(reply_text.strip())
+            await discord_call("reply", message.reply(reply_text.strip()), message.channel)
         except Exception as e:
             print(f"Erreur Gemini Chat: {e}", flush=True)
-            await message.reply("❌ Erreur API Gemini.")
+            await discord_call("reply", message.reply("❌ Erreur API Gemini."), message.channel)
+
+@traced("terminal.fetch")
+def fetch_terminal_data(ticker):
+    # Symbole déjà résolu par RESOLVER (crypto -> "-USD" compris) : un seul download
+    stock = CachedTicker(ticker)
+    df = stock.history(period="1y")
+    used_ticker = ticker
+
+    if df.empty or len(df) < 30: return None
+
+    ind = compute_indicators(*frames_to_matrix([df]))
+    metrics = calculate_metrics(stock, df, ind)
+    macro = get_market_context()
+    insider, options, earnings = get_smart_money_data(stock, metrics["QuoteType"])
+    
+    info = stock.info
+    desc = info.get('longBusinessSummary', info.get('description', ''))
+    if len(desc) < 10: desc = f"N/A. INVENT 1 SHORT SENTENCE DESCRIBING {used_ticker}."
+    else: desc = desc[:1000] + "..."
+    
+    chart = chart_png(df, used_ticker, ind)
+    return metrics, macro, insider, options, earnings, desc, chart, used_ticker
+
+@traced("terminal.build")
+async def build_terminal(ticker):
+    # Pipeline complet d'un terminal, indépendant du salon : le résultat est partageable entre demandes
+    data = await asyncio.to_thread(fetch_terminal_data, ticker)
+    if not data: return None
+
+    metrics, macro, insider, options, earnings, desc, chart, final_ticker = data
+    flow = options_prompt(options)
+    
+    prompt = f"""
+    Role: Quant Desk Manager. Asset: {final_ticker} ({metrics['QuoteType']}).
+    Macro: {macro} | Price: ${metrics['Price']:.2f} | RSI: {metrics['RSI']:.1f} | Drawdown: {metrics['MaxDD']:.1f}%
+    Squeeze: {metrics['Squeeze']} | Options: {flow} (Note: P/C <0.7 is bullish/optimistic, >1.0 is bearish/fear; unusual = volume far above open interest) | Insider: {insider} | Earnings: {earnings}
+    Desc: {desc}
+    
+    RULES (CRITICAL):
+    1. NO SHORT SELLING. NO PUTS. LONG OR CASH ONLY. If bearish, you MUST say "AVOID" or "STAY IN CASH".
+    2. Format exactly as requested below. DO NOT USE MARKDOWN (NO ASTERISKS) for headers.
+
+    OUTPUT FORMAT:
+    [SENTIMENT]: 0-100
+    [POLITICAL]: 0-10
+    [SUMMARY]: 2 sentences max.
+    [THESIS]: 1 sentence punchline.
+    [DRIVERS]: 2 short bullets.
+    [RISKS]: 2 short bullets.
+    [VERDICT]: Action (Buy/Hold/Avoid/Cash), Target, Stop-Loss.
+    """
+    
+    ai_full = await LLM.generate(prompt, memo_cache_key(final_ticker, metrics, macro, options, insider, earnings))
+    
+    # Parsing Anti-Casse
+    sent_val, pol_str, ai_profile = 50, "5", "Profile indisponible."
+    if m := re.search(r'\[SENTIMENT\]:\s*(\d+)', ai_full, re.I): sent_val = int(m.group(1))
+    if m := re.search(r'\[POLITICAL\]:\s*(\d+)', ai_full, re.I): pol_str = m.group(1)
+    if m := re.search(r'\[SUMMARY\]:\s*(.*?)(?=\[THESIS\]|\Z)', ai_full, re.I | re.DOTALL): ai_profile = m.group(1).strip()
+        
+    # Formatage propre pour Discord
+    ai_clean = ai_full
+    ai_clean = re.sub(r'\[SENTIMENT\].*\n?', '', ai_clean, flags=re.I)
+    ai_clean = re.sub(r'\[POLITICAL\].*\n?', '', ai_clean, flags=re.I)
+    ai_clean = re.sub(r'\[SUMMARY\].*?(?=\[THESIS\]|\Z)', '', ai_clean, flags=re.I | re.DOTALL).strip()
+    ai_clean = ai_clean.replace('[THESIS]:', '**THESIS:**')
+    ai_clean = ai_clean.replace('[DRIVERS]:', '**DRIVERS:**')
+    ai_clean = ai_clean.replace('[RISKS]:', '**RISKS:**')
+    ai_clean = ai_clean.replace('[VERDICT]:', '**VERDICT:**')
+
+    # Embed UI
+    embed = discord.Embed(title=f"💠 {final_ticker} | Institutional Desk", color=0x2b2d31)
+    embed.set_author(name=f"Macro: {macro}", icon_url="https://cdn-icons-png.flaticon.com/512/3135/3135715.png")
+    embed.description = f"*{ai_profile}*"
+    
+    col1 = f"`PRICE `: ${metrics['Price']:.2f}\n`TREND `: {metrics['Trend']}\n`RSI   `: {metrics['RSI']:.1f}"
+    if metrics['Squeeze']: col1 += "\n`SQUEZ `: ⚠️ YES"
+    
+    if metrics['QuoteType'] == "CRYPTOCURRENCY":
+        col2 = f"`CAP   `: ${metrics.get('MarketCap',0)/1e9:.1f}B\n`VOL24 `: ${metrics.get('Volume24h',0)/1e9:.1f}B\n`MAX DD`: {metrics['MaxDD']:.1f}%"
+        col3 = f"`WHALE `: {metrics['Whale_Z']:.2f}\n`P/C   `: N/A\n`EARN  `: N/A"
+    elif metrics['QuoteType'] == "ETF":
+        col2 = f"`YIELD `: {metrics.get('Yield',0):.2f}%\n`ASSETS`: ${metrics.get('ExpenseRatio',0)/1e9:.1f}B\n`MAX DD`: {metrics['MaxDD']:.1f}%"
+        col3 = f"`WHALE `: {metrics['Whale_Z']:.2f}\n{options_field(options)}\n`EARN  `: N/A"
+    else:
+        col2 = f"`FAIR  `: ${metrics.get('Fair_Val',0):.2f}\n`P/E   `: {metrics.get('PE',0):.1f}x\n`MAX DD`: {metrics['MaxDD']:.1f}%"
+        col3 = f"`WHALE `: {metrics['Whale_Z']:.2f}\n{options_field(options)}\n`EARN  `: {earnings}"
+
+    embed.add_field(name="📈 Techs", value=col1, inline=True)
+    embed.add_field(name="💰 Value / Risk", value=col2, inline=True)
+    embed.add_field(name="🧠 Flow / Events", value=col3, inline=True)
+    embed.add_field(name="📊 Quant Scores", value=f"`SENTIMENT:` {create_ascii_bar(sent_val)} {sent_val} | `POL RISK:` {pol_str}/10", inline=False)
+
+    embed_memo = discord.Embed(color=0x5865F2, description=ai_clean)
+    embed_memo.set_footer(text="Pollux bloomberg terminal (Powered by Gemini)")
+
+    memory = f"[{final_ticker}]: P=${metrics['Price']:.2f}, RSI={metrics['RSI']:.1f}, Info: {ai_profile[:100]}..."
+    return {"ticker": final_ticker, "chart": chart, "embed": embed, "embed_memo": embed_memo, "memory": memory}
+
+# --- DISPATCHER D'ANALYSES (coalescing + file équitable par salon) ---
+ANALYSIS_MAX_CONCURRENT = int(os.getenv("ANALYSIS_MAX_CONCURRENT", 3))
+ANALYSIS_REUSE_SEC = int(os.getenv("ANALYSIS_REUSE_SEC", 120))
+
+class AnalysisDispatcher:
+    def __init__(self, limit, reuse_sec):
+        self.limit, self.reuse_sec, self.running = limit, reuse_sec, 0
+        self.inflight = {}           # ticker -> Future partagé par toutes les demandes simultanées
+        self.recent = {}             # ticker -> (instant, payload)
+        self.queues = OrderedDict()  # salon -> deque de demandes en attente (round-robin entre salons)
+
+    def waiting(self): return sum(len(q) for q in self.queues.values())
+
+    async def _acquire(self, channel_id, on_queued):
+        if self.running < self.limit and not self.waiting():
+            self.running += 1
+            return
+        gate = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(channel_id, deque()).append(gate)
+        try:
+            if on_queued:
+                # Notification best-effort : un statut supprimé ou une erreur HTTP ne doit pas casser la file
+                try: await on_queued(self.waiting())
+                except Exception as e:
+                    TRACER.error("analysis.queued", e)
+                    print(f"Notification de file ignorée: {e}", flush=True)
+            await gate
+        except BaseException:
+            # Porte déjà ouverte -> le slot nous appartient, on le rend ; sinon on la retire de la file
+            if gate.done() and not gate.cancelled(): self._release()
+            else: self._forget(channel_id, gate)
+            raise
+
+    def _forget(self, channel_id, gate):
+        gate.cancel()
+        q = self.queues.get(channel_id)
+        if q is None: return
+        try: q.remove(gate)
+        except ValueError: pass
+        if not q: del self.queues[channel_id]
+
+    def _release(self):
+        # Le slot passe au prochain salon en attente, pas au prochain message : un salon bavard ne monopolise pas le bot
+        for cid in list(self.queues):
+            q = self.queues.pop(cid)
+            while q and q[0].done(): q.popleft()
+            if not q: continue
+            gate = q.popleft()
+            if q: self.queues[cid] = q
+            gate.set_result(None)
+            return
+        self.running -= 1
+
+    async def submit(self, ticker, channel_id, on_queued=None):
+        hit = self.recent.get(ticker)
+        if hit and time.monotonic() - hit[0] < self.reuse_sec: return hit[1]
+        if ticker in self.inflight: return await asyncio.shield(self.inflight[ticker])
+
+        fut = self.inflight[ticker] = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            await self._acquire(channel_id, on_queued)
+            try: payload = await build_terminal(ticker)
+            finally: self._release()
+            if payload: self.recent[ticker] = (time.monotonic(), payload)
+            fut.set_result(payload)
+            return payload
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            self.inflight.pop(ticker, None)
+            now = time.monotonic()
+            for t in [t for t, (ts, _) in self.recent.items() if now - ts >= self.reuse_sec]: del self.recent[t]
+
+ANALYSIS = AnalysisDispatcher(ANALYSIS_MAX_CONCURRENT, ANALYSIS_REUSE_SEC)
 
 async def run_analysis(message, ticker_input):
     ticker = ticker_input.upper().strip()
     if ticker in COMMON_TYPOS: ticker = COMMON_TYPOS[ticker]
         
-    await message.add_reaction("⚡")
-    status_msg = await message.channel.send(f"🔄 **Terminal : {ticker}...**")
+    channel = message.channel
+    await discord_call("react", message.add_reaction("⚡"), channel)
+    status_msg = await discord_call("send", channel.send(f"🔄 **Terminal : {ticker}...**"), channel)
+
+    async def on_queued(position):
+        await discord_call("edit", status_msg.edit(content=f"⏳ **Terminal : {ticker}** — en file d'attente (position {position})..."), channel)
 
+    t0 = time.perf_counter()
     try:
-        def fetch_data():
-            stock = yf.Ticker(ticker)
-            df = stock.history(period="1y")
-            used_ticker = ticker
-            if df.empty and "-" not in ticker:
-                used_ticker = f"{ticker}-USD"
-                stock = yf.Ticker(used_ticker)
-                df = stock.history(period="1y")
-
-            if df.empty or len(df) < 30: return None
-
-            metrics = calculate_metrics(stock, df)
-            macro = get_market_context()
-            insider, pc_ratio, earnings = get_smart_money_data(stock, metrics["QuoteType"])
-            
-            info = stock.info
-            desc = info.get('longBusinessSummary', info.get('description', ''))
-            if len(desc) < 10: desc = f"N/A. INVENT 1 SHORT SENTENCE DESCRIBING {used_ticker}."
-            else: desc = desc[:1000] + "..."
-            
-            chart = generate_pro_chart(df, used_ticker)
-            return metrics, macro, insider, pc_ratio, earnings, desc, chart, used_ticker
-
-        data = await asyncio.to_thread(fetch_data)
-        if not data: return await status_msg.edit(content=f"❌ Erreur Data `{ticker}`.")
-
-        metrics, macro, insider, pc_ratio, earnings, desc, chart, final_ticker = data
-        
-        prompt = f"""
-        Role: Quant Desk Manager. Asset: {final_ticker} ({metrics['QuoteType']}).
-        Macro: {macro} | Price: ${metrics['Price']:.2f} | RSI: {metrics['RSI']:.1f} | Drawdown: {metrics['MaxDD']:.1f}%
-        Squeeze: {metrics['Squeeze']} | P/C Ratio: {pc_ratio} (Note: <0.7 is bullish/optimistic, >1.0 is bearish/fear) | Insider: {insider} | Earnings: {earnings}
-        Desc: {desc}
-        
-        RULES (CRITICAL):
-        1. NO SHORT SELLING. NO PUTS. LONG OR CASH ONLY. If bearish, you MUST say "AVOID" or "STAY IN CASH".
-        2. Format exactly as requested below. DO NOT USE MARKDOWN (NO ASTERISKS) for headers.
-
-        OUTPUT FORMAT:
-        [SENTIMENT]: 0-100
-        [POLITICAL]: 0-10
-        [SUMMARY]: 2 sentences max.
-        [THESIS]: 1 sentence punchline.
-        [DRIVERS]: 2 short bullets.
-        [RISKS]: 2 short bullets.
-        [VERDICT]: Action (Buy/Hold/Avoid/Cash), Target, Stop-Loss.
-        """
-        
-        response = await asyncio.to_thread(gemini_client.models.generate_content, model='gemini-2.5-flash', contents=prompt)
-        ai_full = response.text
-        
-        # Parsing Anti-Casse
-        sent_val, pol_str, ai_profile = 50, "5", "Profile indisponible."
-        if m := re.search(r'\[SENTIMENT\]:\s*(\d+)', ai_full, re.I): sent_val = int(m.group(1))
-        if m := re.search(r'\[POLITICAL\]:\s*(\d+)', ai_full, re.I): pol_str = m.group(1)
-        if m := re.search(r'\[SUMMARY\]:\s*(.*?)(?=\[THESIS\]|\Z)', ai_full, re.I | re.DOTALL): ai_profile = m.group(1).strip()
-            
-        # Formatage propre pour Discord
-        ai_clean = ai_full
-        ai_clean = re.sub(r'\[SENTIMENT\].*\n?', '', ai_clean, flags=re.I)
-        ai_clean = re.sub(r'\[POLITICAL\].*\n?', '', ai_clean, flags=re.I)
-        ai_clean = re.sub(r'\[SUMMARY\].*?(?=\[THESIS\]|\Z)', '', ai_clean, flags=re.I | re.DOTALL).strip()
-        ai_clean = ai_clean.replace('[THESIS]:', '**THESIS:**')
-        ai_clean = ai_clean.replace('[DRIVERS]:', '**DRIVERS:**')
-        ai_clean = ai_clean.replace('[RISKS]:', '**RISKS:**')
-        ai_clean = ai_clean.replace('[VERDICT]:', '**VERDICT:**')
+        payload = await ANALYSIS.submit(ticker, message.channel.id, on_queued)
+        if not payload: return await discord_call("edit", status_msg.edit(content=f"❌ Erreur Data `{ticker}`."), channel)
 
         # Update Memory 
-        cid = message.channel.id
-        if cid not in CHAT_HISTORY: CHAT_HISTORY[cid] = deque(maxlen=5)
-        CHAT_HISTORY[cid].append(f"[{final_ticker}]: P=${metrics['Price']:.2f}, RSI={metrics['RSI']:.1f}, Info: {ai_profile[:100]}...")
-
-        # Embed UI
-        embed = discord.Embed(title=f"💠 {final_ticker} | Institutional Desk", color=0x2b2d31)
-        embed.set_author(name=f"Macro: {macro}", icon_url="https://cdn-icons-png.flaticon.com/512/3135/3135715.png")
-        embed.description = f"*{ai_profile}*"
-        
-        col1 = f"`PRICE `: ${metrics['Price']:.2f}\n`TREND `: {metrics['Trend']}\n`RSI   `: {metrics['RSI']:.1f}"
-        if metrics['Squeeze']: col1 += "\n`SQUEZ `: ⚠️ YES"
-        
-        if metrics['QuoteType'] == "CRYPTOCURRENCY":
-            col2 = f"`CAP   `: ${metrics.get('MarketCap',0)/1e9:.1f}B\n`VOL24 `: ${metrics.get('Volume24h',0)/1e9:.1f}B\n`MAX DD`: {metrics['MaxDD']:.1f}%"
-            col3 = f"`WHALE `: {metrics['Whale_Z']:.2f}\n`P/C   `: N/A\n`EARN  `: N/A"
-        elif metrics['QuoteType'] == "ETF":
-            col2 = f"`YIELD `: {metrics.get('Yield',0):.2f}%\n`ASSETS`: ${metrics.get('ExpenseRatio',0)/1e9:.1f}B\n`MAX DD`: {metrics['MaxDD']:.1f}%"
-            col3 = f"`WHALE `: {metrics['Whale_Z']:.2f}\n`P/C   `: {pc_ratio}\n`EARN  `: N/A"
+        MEMORY.remember(message.channel.id, {payload["ticker"]: payload["memory"]})
+
+        # 1 seul appel : statut -> graphique + terminal + mémo
+        await deliver(channel, status_msg, [payload["embed"], payload["embed_memo"]], payload["chart"], f"{payload['ticker']}_chart.png")
+        TRACER.record("terminal.total", time.perf_counter() - t0)
+        if BOOT["first_terminal"] is None:
+            BOOT["first_terminal"] = time.perf_counter() - t0
+            TRACER.record("startup.first_terminal", BOOT["first_terminal"])
+            print(f"⏱️ Premier terminal : {BOOT['first_terminal']:.2f}s ({time.perf_counter() - BOOT_T0:.1f}s après le lancement)", flush=True)
+
+    except Exception as e:
+        TRACER.record("terminal.total", time.perf_counter() - t0, e)
+        await discord_call("edit", status_msg.edit(content="❌ Crash interne de génération."), channel)
+        print(f"ERROR: {e}", flush=True)
+
+# --- COMPARATIF MULTI-TICKERS (1 download groupé, 1 passe vectorisée, 1 graphique, 1 appel LLM) ---
+COMPARE_MAX = int(os.getenv("COMPARE_MAX", 8))
+COMPARE_BARS = 126
+
+def _render_compare_png(perf, title):
+    buf = io.BytesIO()
+    with plt.style.context("dark_background"):
+        fig, ax = plt.subplots(figsize=(10, 5))
+        for col in perf.columns:
+            ax.plot(perf.index, perf[col], linewidth=1.2, label=f"{col} {perf[col].iloc[-1] - 100:+.1f}%")
+        ax.axhline(100, color="grey", linestyle=":", linewidth=0.8)
+        ax.set_title(title)
+        ax.set_ylabel("Base 100")
+        ax.grid(linestyle=":", alpha=0.4)
+        ax.legend(loc="upper left", fontsize=8)
+        fig.savefig(buf, dpi=100, bbox_inches="tight")
+        plt.close(fig)
+    return buf.getvalue()
+
+def _compare_row(ticker, df, ind, i):
+    stock = CachedTicker(ticker)
+    metrics = calculate_metrics(stock, df, ind, i)
+    metrics["Insider"], _, metrics["Earnings"] = get_smart_money_data(stock, metrics["QuoteType"], ("insider", "earnings"))
+    return metrics
+
+@traced("compare.fetch")
+def fetch_compare_data(tickers):
+    frames = batch_history(tickers)
+    tickers = [t for t in tickers if t in frames and len(frames[t]) >= 30]
+    if len(tickers) < 2: return None
+    ind = compute_indicators(*frames_to_matrix([frames[t] for t in tickers]))
+    rows = list(SCAN_POOL.map(_compare_row, tickers, [frames[t] for t in tickers], [ind] * len(tickers), range(len(tickers))))
+
+    # Performance base 100 sur ~6 mois, dates alignées (les cryptos cotent le week-end : report de la dernière clôture)
+    closes = pd.DataFrame({t: frames[t]['Close'] for t in tickers}).sort_index().ffill().tail(COMPARE_BARS)
+    perf = closes / closes.bfill().iloc[0] * 100
+    for t, m in zip(tickers, rows): m["Perf"] = float(perf[t].iloc[-1] - 100)
+    last = str(closes.index[-1].date())
+    chart = render_chart(_render_compare_png, ("compare", tuple(tickers), last), perf, " vs ".join(tickers) + " | Base 100")
+    return tickers, rows, get_market_context(), chart
+
+def compare_table(tickers, rows):
+    lines = [f"{'':<8}{'PRIX':>10}{'6M':>8}{'RSI':>6}{'MAXDD':>7}{'WHALE':>7}  TREND"]
+    for t, m in zip(tickers, rows):
+        lines.append(f"{t[:8]:<8}{m['Price']:>10.2f}{m['Perf']:>+7.1f}%{m['RSI']:>6.0f}{m['MaxDD']:>6.0f}%{m['Whale_Z']:>7.1f}  {m['Trend'].split()[0]}")
+    return "```\n" + "\n".join(lines) + "```"
+
+@traced("compare.build")
+async def build_compare(tickers):
+    data = await asyncio.to_thread(fetch_compare_data, tickers)
+    if not data: return None
+    tickers, rows, macro, chart = data
+
+    context = "\n".join(f"- {t} ({m['QuoteType']}, {m['Sector']}): Price ${m['Price']:.2f} | 6M {m['Perf']:+.1f}% | RSI {m['RSI']:.1f} | "
+                        f"Drawdown {m['MaxDD']:.1f}% | Trend {m['Trend']} | Whale Z {m['Whale_Z']:.1f} | Squeeze {m['Squeeze']} | "
+                        f"Insider {m['Insider']} | Earnings {m['Earnings']}" for t, m in zip(tickers, rows))
+    prompt = f"""
+    Role: Quant Desk Manager. Peer comparison. Macro: {macro}
+    {context}
+
+    RULES (CRITICAL):
+    1. NO SHORT SELLING. NO PUTS. LONG OR CASH ONLY. If bearish, you MUST say "AVOID" or "STAY IN CASH".
+    2. Format exactly as requested below. DO NOT USE MARKDOWN (NO ASTERISKS) for headers.
+
+    OUTPUT FORMAT:
+    [RANKING]: tickers from best to worst setup, one line.
+    [SUMMARY]: 2 sentences max.
+    [VERDICT]: one short line per ticker: Action (Buy/Hold/Avoid/Cash).
+    """
+    # Clé sur des entrées arrondies (comme memo_cache_key) : le contexte du prompt bouge à chaque tick de prix ou de VIX
+    coarse = sorted([t, f"{m['Price']:.3g}", round(m['Perf']), round(m['RSI']), round(m['MaxDD']), round(m['Whale_Z']), m['Trend'].startswith("UP"),
+                     bool(m['Squeeze']), m['Insider'], m['Earnings']] for t, m in zip(tickers, rows))
+    cache_key = hashlib.sha256(json.dumps([coarse, macro_bucket(macro), str(market_today())], ensure_ascii=False).encode()).hexdigest()
+    ai_full = await LLM.generate(prompt, cache_key)
+    ai_clean = ai_full.replace('[RANKING]:', '**RANKING:**').replace('[SUMMARY]:', '**SUMMARY:**').replace('[VERDICT]:', '**VERDICT:**').strip()
+
+    embed = discord.Embed(title=f"⚖️ {' vs '.join(tickers)} | Peer Desk", color=0x2b2d31, description=compare_table(tickers, rows))
+    embed.set_author(name=f"Macro: {macro}", icon_url="https://cdn-icons-png.flaticon.com/512/3135/3135715.png")
+    embed_memo = discord.Embed(color=0x5865F2, description=ai_clean[:4000])
+    embed_memo.set_footer(text="Pollux bloomberg terminal (Powered by Gemini)")
+    memory = {t: f"[COMPARE {'/'.join(tickers)}]: {t} ${m['Price']:.2f} 6M {m['Perf']:+.1f}% RSI {m['RSI']:.0f}" for t, m in zip(tickers, rows)}
+    return {"tickers": tickers, "chart": chart, "embed": embed, "embed_memo": embed_memo, "memory": memory}
+
+# --- MOTEUR DE RISQUE PORTEFEUILLE (covariance glissante incrémentale, VaR, clusters) ---
+RISK_WINDOW = int(os.getenv("RISK_WINDOW", 252))
+RISK_CLUSTER_CORR = float(os.getenv("RISK_CLUSTER_CORR", 0.7))
+RISK_ENGINES = {}  # scope watchlist -> RiskEngine
+
+class RiskEngine:
+    # Statistiques suffisantes sur une fenêtre de W rendements log journaliers (jours ouvrés) :
+    # S1 = somme des rendements (N), S2 = R^T R (N x N). Un nouveau bar coûte O(N²) au lieu de O(W·N²).
+    def __init__(self, window):
+        self.window = window
+        self.symbols, self.last_date, self.last_close = [], None, None
+        self.buf, self.head, self.n, self.updates = None, 0, 0, 0
+        self.s1 = self.s2 = None
+        self.partial = None  # (date, closes) du dernier bar, possiblement en cours : jamais intégré à l'état
+        self.lock = threading.Lock()  # un moteur par scope, partagé entre deux !risk simultanés du même serveur
+
+    def _recompute(self):
+        r = self.buf[:self.n]
+        self.s1, self.s2 = r.sum(axis=0), r.T @ r
+
+    def rebuild(self, symbols, closes):
+        rets = np.log(closes / closes.shift(1)).iloc[1:].fillna(0.0).tail(self.window).to_numpy()
+        self.symbols = symbols
+        self.buf = np.zeros((self.window, len(symbols)))
+        self.n = len(rets)
+        self.buf[:self.n] = rets
+        self.head, self.updates = self.n % self.window, 0
+        self.last_date, self.last_close = closes.index[-1], closes.iloc[-1].to_numpy()
+        self._recompute()
+
+    def update(self, date, close):
+        with np.errstate(invalid="ignore", divide="ignore"): r = np.nan_to_num(np.log(close / self.last_close), nan=0.0, posinf=0.0, neginf=0.0)
+        old = self.buf[self.head] if self.n == self.window else np.zeros_like(r)
+        self.s1 += r - old
+        self.s2 += np.outer(r, r) - np.outer(old, old)
+        self.buf[self.head] = r
+        self.head = (self.head + 1) % self.window
+        self.n = min(self.n + 1, self.window)
+        self.last_date, self.last_close = date, np.where(np.isnan(close), self.last_close, close)
+        # Recalcul complet à chaque tour de fenêtre pour éviter la dérive des sommes
+        self.updates += 1
+        if self.updates % self.window == 0: self._recompute()
+
+    def sync(self, frames):
+        # Mêmes symboles et historique cohérent -> seulement les nouveaux bars ; sinon (watchlist modifiée, ajustement) reconstruction.
+        # L'état ne contient que des bars clôturés (comme OHLCVStore) : le dernier bar, possiblement partiel, reste dans self.partial
+        # pour que sa clôture définitive ne passe pas pour un ajustement et ne force pas un rebuild().
+        symbols = [t for t in frames if len(frames[t]) > self.window // 4]
+        closes = pd.DataFrame({t: frames[t]['Close'] for t in symbols}).sort_index().ffill()
+        closes = closes[closes.index.dayofweek < 5]  # cryptos : le week-end est reporté sur le lundi
+        if len(closes) < 3: return False
+        done = closes.iloc[:-1]
+        known = self.symbols == symbols and self.last_date is not None and self.last_date in done.index
+        if not known or not np.allclose(done.loc[self.last_date].to_numpy(), self.last_close, rtol=1e-6, equal_nan=True):
+            self.rebuild(symbols, done)
         else:
-            col2 = f"`FAIR  `: ${metrics.get('Fair_Val',0):.2f}\n`P/E   `: {metrics.get('PE',0):.1f}x\n`MAX DD`: {metrics['MaxDD']:.1f}%"
-            col3 = f"`WHALE `: {metrics['Whale_Z']:.2f}\n`P/C   `: {pc_ratio}\n`EARN  `: {earnings}"
+            for date, row in done[done.index > self.last_date].iterrows(): self.update(date, row.to_numpy())
+        self.partial = (closes.index[-1], closes.iloc[-1].to_numpy())
+        return True
 
-        embed.add_field(name="📈 Techs", value=col1, inline=True)
-        embed.add_field(name="💰 Value / Risk", value=col2, inline=True)
-        embed.add_field(name="🧠 Flow / Events", value=col3, inline=True)
-        embed.add_field(name="📊 Quant Scores", value=f"`SENTIMENT:` {create_ascii_bar(sent_val)} {sent_val} | `POL RISK:` {pol_str}/10", inline=False)
+    def _with_partial(self):
+        # Copie provisoire avec le dernier bar appliqué : le résumé le voit, l'état partagé non
+        clone = RiskEngine.__new__(RiskEngine)
+        clone.__dict__.update(self.__dict__, buf=self.buf.copy(), s1=self.s1.copy(), s2=self.s2.copy(), partial=None)
+        clone.update(*self.partial)
+        return clone
 
-        embed_memo = discord.Embed(color=0x5865F2, description=ai_clean)
-        embed_memo.set_footer(text="Pollux bloomberg terminal (Powered by Gemini)")
+    def covariance(self):
+        mean = self.s1 / self.n
+        return (self.s2 - self.n * np.outer(mean, mean)) / max(self.n - 1, 1), mean
 
-        await status_msg.delete()
-        await message.channel.send(file=chart, embed=embed)
-        await message.channel.send(embed=embed_memo)
+    def summary(self, top=5):
+        if self.partial: return self._with_partial().summary(top)
+        cov, mean = self.covariance()
+        vol = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(invalid="ignore", divide="ignore"): corr = cov / np.outer(vol, vol)
+        corr = np.nan_to_num(corr)
+        N = len(self.symbols)
+        w = np.full(N, 1 / N)  # portefeuille équipondéré : la watchlist n'a pas de positions
+        port_var = float(w @ cov @ w)
+        port_vol = np.sqrt(max(port_var, 0.0))
+        hist = self.buf[:self.n] @ w
+        iu = np.triu_indices(N, 1)
+        pair_corr = corr[iu]
+        order = np.argsort(-pair_corr)[:top]
+        avg_corr = (corr.sum(axis=1) - 1) / max(N - 1, 1)
+        contrib = w * (cov @ w) / port_var * 100 if port_var > 0 else np.zeros(N)
+        return {
+            "symbols": N, "days": self.n, "vol_annual": port_vol * np.sqrt(252) * 100,
+            "var95": (1.645 * port_vol - mean @ w) * 100, "var99": (2.326 * port_vol - mean @ w) * 100,
+            "hvar95": -np.percentile(hist, 5) * 100 if self.n else 0.0,
+            "avg_corr": float(pair_corr.mean()) if len(pair_corr) else 0.0,
+            "pairs": [(self.symbols[iu[0][k]], self.symbols[iu[1][k]], float(pair_corr[k])) for k in order],
+            "diversifiers": [(self.symbols[i], float(avg_corr[i])) for i in np.argsort(avg_corr)[:3]],
+            "contributors": [(self.symbols[i], float(contrib[i])) for i in np.argsort(-contrib)[:3]],
+            "clusters": self.clusters(corr),
+        }
 
-    except Exception as e:
-        await status_msg.edit(content="❌ Crash interne de génération.")
-        print(f"ERROR: {e}", flush=True)
+    def clusters(self, corr, threshold=None):
+        # Union-find sur les paires au-dessus du seuil : groupes de titres qui bougent ensemble
+        threshold = RISK_CLUSTER_CORR if threshold is None else threshold
+        parent = list(range(len(self.symbols)))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        for i, j in np.argwhere(np.triu(corr > threshold, 1)): parent[find(i)] = find(j)
+        groups = {}
+        for i in range(len(self.symbols)): groups.setdefault(find(i), []).append(self.symbols[i])
+        return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
+
+@traced("risk")
+def portfolio_risk(scope, watchlist):
+    frames = batch_history(watchlist, "2y")
+    engine = RISK_ENGINES.setdefault(scope, RiskEngine(RISK_WINDOW))
+    with engine.lock:
+        if not engine.sync({t: frames[t] for t in watchlist if t in frames}) or len(engine.symbols) < 2: return None
+        return engine.summary()
+
+def risk_embed(res):
+    embed = discord.Embed(title="🛡️ Portfolio Risk | Watchlist équipondérée", color=0xC0392B,
+                          description=f"`{res['symbols']}` actifs | `{res['days']}` jours | corrélation moyenne `{res['avg_corr']:.2f}`")
+    embed.add_field(name="📉 Volatilité / VaR (1j)", inline=False,
+                    value=f"`VOL AN `: {res['vol_annual']:.1f}%\n`VaR 95 `: {res['var95']:.2f}% (historique {res['hvar95']:.2f}%)\n`VaR 99 `: {res['var99']:.2f}%")
+    embed.add_field(name="🔗 Paires corrélées", value="\n".join(f"`{a}`/`{b}` {c:.2f}" for a, b, c in res["pairs"]) or "N/A", inline=True)
+    embed.add_field(name="🎯 Contribution au risque", value="\n".join(f"`{t}` {c:.0f}%" for t, c in res["contributors"]) or "N/A", inline=True)
+    embed.add_field(name="🌱 Diversifiants", value="\n".join(f"`{t}` ρ̄ {c:.2f}" for t, c in res["diversifiers"]) or "N/A", inline=True)
+    clusters = "\n".join(f"• {', '.join(g)}" for g in res["clusters"][:6])
+    embed.add_field(name=f"🧩 Clusters (ρ > {RISK_CLUSTER_CORR:.1f})", value=clusters[:1024] or "Aucun : watchlist diversifiée.", inline=False)
+    return embed
+
+# --- BACKTEST VECTORISÉ DES RÈGLES DU SCANNER (symboles x jours x seuils) ---
+BACKTEST_CHUNK = int(os.getenv("BACKTEST_CHUNK", 250))
+BACKTEST_HORIZONS = (5, 20, 60)
+# règle -> (matrice d'Indicators, sens, seuils balayés, seuil actuel du scanner)
+BACKTEST_SWEEPS = {
+    "whale": ("whale_z", ">", (1.5, 2.0, 2.5, 3.0, 3.5, 4.0), 2.5),
+    "oversold": ("rsi", "<", (20, 25, 30, 35, 40), 30),
+    "squeeze": ("bb_width", "<", (0.03, 0.04, 0.05, 0.06, 0.08), 0.05),
+}
+
+def forward_outcomes(close, horizons=BACKTEST_HORIZONS):
+    # Par horizon h : colonnes [valide, rendement à h jours, rendement > 0, pire drawdown sur les h jours] pour chaque (symbole, jour)
+    S, T = close.shape
+    cols = []
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for h in horizons:
+            fwd, dd = np.full((S, T), np.nan), np.full((S, T), np.nan)
+            if T > h:
+                fwd[:, :-h] = close[:, h:] / close[:, :-h] - 1
+                dd[:, :-h] = np.lib.stride_tricks.sliding_window_view(close[:, 1:], h, axis=1).min(axis=-1) / close[:, :-h] - 1
+            valid = np.isfinite(fwd) & np.isfinite(dd)
+            cols += [valid, np.where(valid, fwd, 0.0), valid & (fwd > 0), np.where(valid, np.fmin(dd, 0.0), 0.0)]
+    return np.stack([c.reshape(-1).astype("f8") for c in cols], axis=1)  # (S*T, 4H)
+
+@traced("backtest.chunk")
+def backtest_chunk(frames):
+    # Un chunk -> sommes par (règle, seuil) : les événements (déclenchements, pas les jours consécutifs) x issues en un produit matriciel
+    close, volume = frames_to_matrix(frames)
+    ind = compute_indicators(close, volume)
+    outcomes = forward_outcomes(close)
+    sums = {"baseline": outcomes.sum(axis=0)}
+    for rule, (field, op, thresholds, _) in BACKTEST_SWEEPS.items():
+        x, thr = getattr(ind, field), np.asarray(thresholds)[:, None, None]
+        with np.errstate(invalid="ignore"): cond = x[None] > thr if op == ">" else x[None] < thr  # (K, S, T), NaN -> False
+        onset = cond.copy()
+        onset[:, :, 1:] &= ~cond[:, :, :-1]
+        sums[rule] = onset.reshape(len(thresholds), -1).astype("f8") @ outcomes  # (K, 4H)
+    return sums, close.shape
+
+def _backtest_table(sums):
+    n, ret, hits, dd = (sums[..., k::4] for k in range(4))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {"n": n, "mean": ret / n * 100, "hit": hits / n * 100, "dd": dd / n * 100}
+
+@traced("backtest")
+def run_backtest(symbols, period="5y"):
+    totals, n_symbols, days = {}, 0, 0
+    for i in range(0, len(symbols), BACKTEST_CHUNK):
+        frames = [df for df in OHLCV_STORE.batch(symbols[i:i + BACKTEST_CHUNK], period).values() if len(df) > max(BACKTEST_HORIZONS)]
+        if not frames: continue
+        sums, (S, T) = backtest_chunk(frames)
+        for k, v in sums.items(): totals[k] = totals.get(k, 0) + v
+        n_symbols, days = n_symbols + S, max(days, T)
+    if not totals: return None
+    return {"symbols": n_symbols, "days": days, "period": period, "baseline": _backtest_table(totals.pop("baseline")),
+            "rules": {rule: _backtest_table(v) for rule, v in totals.items()}}
+
+def backtest_embed(name, res, horizon=20):
+    h = BACKTEST_HORIZONS.index(horizon)
+    base = res["baseline"]
+    embed = discord.Embed(title=f"🧪 Backtest Scanner | {name.upper()} ({res['period']})", color=0x8E44AD,
+                          description=f"`{res['symbols']}` symboles | `{res['days']}` jours | horizon **{horizon}j** | "
+                                      f"référence : {base['mean'][h]:+.2f}% moyen, {base['hit'][h]:.0f}% positifs, DD {base['dd'][h]:.1f}%")
+    labels = {"whale": "🐳 Whale Z >", "oversold": "📉 RSI <", "squeeze": "🗜️ BB Width <"}
+    for rule, (_, _, thresholds, current) in BACKTEST_SWEEPS.items():
+        t = res["rules"][rule]
+        lines = [f"{'SEUIL':>6}{'N':>7}{'MOY':>8}{'HIT':>6}{'DD':>7}"]
+        for k, thr in enumerate(thresholds):
+            mark = " ◀" if thr == current else ""
+            lines.append(f"{thr:>6g}{int(t['n'][k, h]):>7}{t['mean'][k, h]:>+7.2f}%{t['hit'][k, h]:>5.0f}%{t['dd'][k, h]:>6.1f}%{mark}")
+        embed.add_field(name=labels[rule], value="```\n" + "\n".join(lines) + "```", inline=False)
+    embed.set_footer(text=f"Événements = premier jour où la règle se déclenche. Horizons dispo : {', '.join(map(str, BACKTEST_HORIZONS))}j. Insider non rejoué (pas d'historique).")
+    return embed
 
 @bot.event
 async def on_message(msg):
@@ -421,15 +2602,89 @@ async def on_message(msg):
     if msg.content.startswith('!'): 
         return await bot.process_commands(msg)
     
-    words = msg.content.strip().split()
-    if len(words) == 1 and re.match(r'^[A-Z0-9-.]{2,10}$', msg.content.upper()) and msg.content.upper() not in ["WHY", "HOW", "WHAT", "TEST"]:
-        await run_analysis(msg, msg.content)
-    else:
-        await handle_conversation(msg)
+    word = msg.content.strip()
+    if len(word.split()) == 1 and re.match(r'^\^?[A-Z0-9-.]{2,10}$', word.upper()) and word.upper() not in ["WHY", "HOW", "WHAT", "TEST"]:
+        res = RESOLVER.resolve(word)
+        # Terminal seulement pour un symbole certain (exact, alias, format explicite) : une correction floue ne vaut qu'une suggestion,
+        # presque tout mot de 3 lettres est à 1 faute d'un symbole coté
+        if res and res.match != "fuzzy": return await run_analysis(msg, res.symbol)
+        if word.isupper():
+            hints = RESOLVER.suggest(word)
+            return await discord_call("reply", msg.reply(f"❓ `{word}` : symbole inconnu." + (f" Vouliez-vous dire {', '.join(f'`{h}`' for h in hints)} ?" if hints else "")), msg.channel)
+    await handle_conversation(msg)
+
+# --- EXPORT PROMETHEUS (optionnel, METRICS_PORT > 0) ---
+METRICS_SERVER = None
+
+async def start_metrics_server():
+    global METRICS_SERVER
+    from aiohttp import web  # déjà installé avec discord.py
+
+    async def metrics(request):
+        c, l = MARKET_CACHE.summary(), LLM.summary()
+        extra = [f"# TYPE bot_cache_{k}_total counter\nbot_cache_{k}_total {c[k]}" for k in ("hits", "misses", "coalesced", "evictions")]
+        extra += [f"# TYPE bot_llm_{k}_total counter\nbot_llm_{k}_total {l[k]}" for k in ("calls", "cache_hits", "errors", "prompt_tokens", "output_tokens")]
+        return web.Response(text=TRACER.prometheus() + "\n".join(extra) + "\n", content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    METRICS_SERVER = web.AppRunner(app)
+    await METRICS_SERVER.setup()
+    await web.TCPSite(METRICS_SERVER, METRICS_HOST, METRICS_PORT).start()
+    print(f"📈 Métriques Prometheus : http://{METRICS_HOST}:{METRICS_PORT}/metrics", flush=True)
+
+# --- WARM-UP (après on_ready, en tâche de fond : le bot répond déjà pendant ce temps) ---
+WARMUP_ENABLED = os.getenv("WARMUP", "1") != "0"
+WARMUP_TASK = None
+
+def _warm_chart_pool():
+    # Un job par worker : les processus spawn importent mplfinance et construisent le style avant la 1re demande
+    pool = chart_pool()
+    return {f.result() for f in [pool.submit(_chart_worker_ready) for _ in range(CHART_WORKERS)]}
+
+def _warm_market_session():
+    # Contexte SPY/VIX en cache + session HTTP yfinance (cookie/crumb) ouverte pour info/options
+    get_market_context()
+    CachedTicker("SPY").info
+
+WARMUP_STEPS = (
+    ("imports", lambda: [m.load() for m in (pd, yf, genai)]),  # mplfinance/pyplot ne servent que dans les workers
+    ("chart_pool", _warm_chart_pool),
+    ("market", _warm_market_session),
+    ("llm_client", lambda: getattr(LLM_PROVIDER, "client", None)),
+)
+
+async def warmup():
+    t0 = time.perf_counter()
+    for name, step in WARMUP_STEPS:
+        # Une étape en échec n'empêche pas les suivantes : le chemin normal retentera au premier usage
+        try:
+            with TRACER.span(f"startup.warmup.{name}"): await asyncio.to_thread(step)
+        except Exception as e: print(f"⚠️ Warm-up {name}: {e}", flush=True)
+    BOOT["warmup"] = time.perf_counter() - t0
+    TRACER.record("startup.warmup", BOOT["warmup"])
+    print(f"🔥 Warm-up terminé en {BOOT['warmup']:.1f}s", flush=True)
+
+TRACER.record("startup.import", time.perf_counter() - BOOT_T0)
+
+@tasks.loop(hours=24)
+async def symbol_directory_refresh():
+    await asyncio.to_thread(RESOLVER.load)
 
 @bot.event
 async def on_ready():
-    print(f"✅ V23 GEMINI Online: {bot.user}")
-    daily_scanner.start()
+    global WARMUP_TASK
+    if BOOT["ready"] is None:
+        BOOT["ready"] = time.perf_counter() - BOOT_T0
+        TRACER.record("startup.ready", BOOT["ready"])
+    print(f"✅ V23 GEMINI Online: {bot.user} (prêt en {BOOT['ready']:.1f}s)")
+    if WARMUP_ENABLED and WARMUP_TASK is None: WARMUP_TASK = asyncio.create_task(warmup())
+    if METRICS_PORT > 0 and METRICS_SERVER is None: await start_metrics_server()
+    if not symbol_directory_refresh.is_running(): symbol_directory_refresh.start()
+    # on_ready est rappelé à chaque reconnexion : une boucle déjà lancée lèverait RuntimeError
+    if not daily_scanner.is_running(): daily_scanner.start()
+    if INTRADAY_INTERVAL_MIN > 0 and not intraday_scanner.is_running(): intraday_scanner.start()
+    if SCREEN_UNIVERSE and SCREEN_INTERVAL_H > 0 and not universe_scanner.is_running(): universe_scanner.start()
 
-bot.run(DISCORD_TOKEN)
+if __name__ == "__main__":
+    bot.run(DISCORD_TOKEN)